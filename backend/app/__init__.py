@@ -6,6 +6,7 @@ import os
 import logging # Temporal, solo para ver logs
 from dotenv import load_dotenv
 from .models import db
+from .utils.tree_parser import MAX_TREE_DEPTH
 from flask_login import LoginManager
 from flask_mail import Mail
 
@@ -64,12 +65,159 @@ def create_app(test_config=None):
     app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
     app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', app.config['MAIL_USERNAME'])
 
+    # TREE UPLOAD LIMITS
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+    app.config['TREE_MAX_NODES'] = int(os.getenv('TREE_MAX_NODES', 50000))
+    # Capped by the length of Node.path (fixed-width segment per level)
+    app.config['TREE_MAX_DEPTH'] = min(int(os.getenv('TREE_MAX_DEPTH', 50)), MAX_TREE_DEPTH)
+    app.config['TREE_MAX_LABEL_LENGTH'] = int(os.getenv('TREE_MAX_LABEL_LENGTH', 255))
+    app.config['TREE_MAX_CONTENT_LENGTH'] = int(os.getenv('TREE_MAX_CONTENT_LENGTH', 100000))
+
+    # METRICS: GET /api/metrics needs a login, or this token as a Bearer header (scrapers)
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN', '')
+
+    # CACHE CONFIG
+    app.config['CHATBOT_CACHE_SIZE'] = int(os.getenv('CHATBOT_CACHE_SIZE', 256))
+    app.config['RETRIEVAL_CACHE_SIZE'] = int(os.getenv('RETRIEVAL_CACHE_SIZE', 64))
+    app.config['SESSION_ACCESS_CACHE_SIZE'] = int(os.getenv('SESSION_ACCESS_CACHE_SIZE', 4096))
+    app.config['SESSION_ACCESS_CACHE_TTL'] = int(os.getenv('SESSION_ACCESS_CACHE_TTL', 300))
+
+    # AI PROMPT CONFIG (defaults, overridable per chatbot through ai_settings)
+    app.config['AI_RETRIEVAL_TOP_K'] = int(os.getenv('AI_RETRIEVAL_TOP_K', 8))
+    app.config['AI_CONTEXT_TOKEN_BUDGET'] = int(os.getenv('AI_CONTEXT_TOKEN_BUDGET', 3000))
+    # Knowledge-base serialization in prompts: json | outline
+    app.config['AI_KB_FORMAT'] = os.getenv('AI_KB_FORMAT', 'json')
+
+    # AI CONVERSATION HISTORY (summary + last N messages under a token budget)
+    app.config['AI_HISTORY_MESSAGES'] = int(os.getenv('AI_HISTORY_MESSAGES', 10))
+    app.config['AI_HISTORY_TOKEN_BUDGET'] = int(os.getenv('AI_HISTORY_TOKEN_BUDGET', 1500))
+    # Older unsummarized turns above this size are folded into the summary in the background
+    app.config['AI_SUMMARY_TRIGGER_TOKENS'] = int(os.getenv('AI_SUMMARY_TRIGGER_TOKENS', 1000))
+
+    # AI ANSWER CACHE (TTL in seconds; per-chatbot opt-out via ai_settings.answer_cache)
+    app.config['ANSWER_CACHE_ENABLED'] = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() in ['true', 'on', '1']
+    app.config['ANSWER_CACHE_SIZE'] = int(os.getenv('ANSWER_CACHE_SIZE', 1024))
+    app.config['ANSWER_CACHE_TTL'] = int(os.getenv('ANSWER_CACHE_TTL', 600))
+    # Include a hash of the earlier conversation in the key (safer, fewer hits)
+    app.config['ANSWER_CACHE_HISTORY_AWARE'] = os.getenv('ANSWER_CACHE_HISTORY_AWARE', 'true').lower() in ['true', 'on', '1']
+
+    # Share one provider call between identical concurrent questions without history
+    app.config['AI_SINGLE_FLIGHT'] = os.getenv('AI_SINGLE_FLIGHT', 'true').lower() in ['true', 'on', '1']
+
+    # AI JOB QUEUE (AI_JOB_WORKERS=0 answers /ask inline)
+    app.config['AI_JOB_WORKERS'] = int(os.getenv('AI_JOB_WORKERS', 4))
+    app.config['AI_JOB_QUEUE_SIZE'] = int(os.getenv('AI_JOB_QUEUE_SIZE', 100))
+    app.config['AI_JOB_RESULT_TTL'] = int(os.getenv('AI_JOB_RESULT_TTL', 600))
+
+    # AI PROVIDER CLIENT (created once per process; AI_WARMUP connects at startup)
+    app.config['AI_MODEL'] = os.getenv('AI_MODEL', 'gemini-flash-latest')
+    app.config['AI_REQUEST_TIMEOUT'] = float(os.getenv('AI_REQUEST_TIMEOUT', 30))
+    app.config['AI_TRANSPORT'] = os.getenv('AI_TRANSPORT', 'rest')
+    # Resilience: overall deadline per answer, bounded retries with jitter,
+    # optional hedged second call and a circuit breaker that fails fast
+    app.config['AI_DEADLINE'] = float(os.getenv('AI_DEADLINE', 45))
+    app.config['AI_RETRIES'] = int(os.getenv('AI_RETRIES', 2))
+    app.config['AI_RETRY_BACKOFF'] = float(os.getenv('AI_RETRY_BACKOFF', 0.5))
+    app.config['AI_HEDGE_AFTER'] = float(os.getenv('AI_HEDGE_AFTER', 0))
+    app.config['AI_BREAKER_THRESHOLD'] = int(os.getenv('AI_BREAKER_THRESHOLD', 5))
+    app.config['AI_BREAKER_RESET'] = float(os.getenv('AI_BREAKER_RESET', 30))
+    app.config['AI_WARMUP'] = os.getenv('AI_WARMUP', 'false').lower() in ['true', 'on', '1']
+    # gemini | mock | fake (unset: gemini when GEMINI_API_KEY is defined, mock otherwise)
+    app.config['AI_PROVIDER'] = os.getenv('AI_PROVIDER', '')
+    # Fake provider for offline load tests (log-normal time to first token)
+    app.config['AI_FAKE_LATENCY_MS'] = float(os.getenv('AI_FAKE_LATENCY_MS', 800))
+    app.config['AI_FAKE_LATENCY_SIGMA'] = float(os.getenv('AI_FAKE_LATENCY_SIGMA', 0.5))
+    app.config['AI_FAKE_TOKENS'] = int(os.getenv('AI_FAKE_TOKENS', 120))
+    app.config['AI_FAKE_TOKENS_PER_SECOND'] = float(os.getenv('AI_FAKE_TOKENS_PER_SECOND', 60))
+    app.config['AI_FAKE_ERROR_RATE'] = float(os.getenv('AI_FAKE_ERROR_RATE', 0))
+    app.config['AI_FAKE_SEED'] = int(os.environ['AI_FAKE_SEED']) if os.getenv('AI_FAKE_SEED') else None
+
+    # WRITE-BEHIND CHAT MESSAGES (socket messages are batched into multi-row inserts)
+    app.config['MESSAGE_BUFFER_ENABLED'] = os.getenv('MESSAGE_BUFFER_ENABLED', 'false').lower() in ['true', 'on', '1']
+    app.config['MESSAGE_BUFFER_BATCH'] = int(os.getenv('MESSAGE_BUFFER_BATCH', 100))
+    app.config['MESSAGE_BUFFER_INTERVAL_MS'] = int(os.getenv('MESSAGE_BUFFER_INTERVAL_MS', 50))
+    app.config['MESSAGE_BUFFER_MAX_PENDING'] = int(os.getenv('MESSAGE_BUFFER_MAX_PENDING', 10000))
+    # Rows the database keeps rejecting are dead-lettered after this many attempts
+    app.config['MESSAGE_BUFFER_MAX_ATTEMPTS'] = int(os.getenv('MESSAGE_BUFFER_MAX_ATTEMPTS', 3))
+
+    # SOCKET.IO ACROSS WORKERS: room emits are relayed through a message queue
+    # (redis://..., 'sql' for the app database, or sql+<url>); unset = single process
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+    app.config['SOCKETIO_CHANNEL'] = os.getenv('SOCKETIO_CHANNEL', 'socketio')
+
     # Init extensions
     db.init_app(app)
     mail.init_app(app)
-    socketio.init_app(app)
+    from .utils.socket_queue import create_client_manager
+    # Always passed explicitly: init_app keeps options from earlier calls
+    socketio.init_app(app, client_manager=create_client_manager(
+        app.config['SOCKETIO_MESSAGE_QUEUE'],
+        channel=app.config['SOCKETIO_CHANNEL'],
+        database_url=db_uri
+    ))
     CORS(app, resources={r"/*": {"origins": "*"}})
 
+    # In-process caches and metrics
+    from .utils.cache import chatbot_cache, retrieval_cache, prompt_cache, answer_cache, session_access_cache
+    from .utils.metrics import metrics
+    from .utils.jobs import ai_jobs
+    from .utils.singleflight import ai_flights
+    chatbot_cache.configure(maxsize=app.config['CHATBOT_CACHE_SIZE'])
+    retrieval_cache.configure(maxsize=app.config['RETRIEVAL_CACHE_SIZE'])
+    prompt_cache.configure(maxsize=app.config['RETRIEVAL_CACHE_SIZE'])
+    answer_cache.configure(maxsize=app.config['ANSWER_CACHE_SIZE'], ttl=app.config['ANSWER_CACHE_TTL'])
+    session_access_cache.configure(maxsize=app.config['SESSION_ACCESS_CACHE_SIZE'], ttl=app.config['SESSION_ACCESS_CACHE_TTL'])
+    ai_jobs.configure(app, socketio,
+                      workers=app.config['AI_JOB_WORKERS'],
+                      maxsize=app.config['AI_JOB_QUEUE_SIZE'],
+                      result_ttl=app.config['AI_JOB_RESULT_TTL'])
+    ai_flights.reset()
+    metrics.reset_timings()
+    metrics.register('chatbot_cache', chatbot_cache.stats)
+    metrics.register('retrieval_cache', retrieval_cache.stats)
+    metrics.register('prompt_cache', prompt_cache.stats)
+    metrics.register('answer_cache', answer_cache.stats)
+    metrics.register('session_access_cache', session_access_cache.stats)
+    metrics.register('ai_jobs', ai_jobs.stats)
+    metrics.register('ai_single_flight', ai_flights.stats)
+
+    # AI provider client
+    from .utils.ai_client import configure_client, warm_up, usage as ai_usage, breaker as ai_breaker
+    configure_client(model=app.config['AI_MODEL'],
+                     timeout=app.config['AI_REQUEST_TIMEOUT'],
+                     transport=app.config['AI_TRANSPORT'],
+                     provider=app.config['AI_PROVIDER'],
+                     fake_options={
+                         'latency_ms': app.config['AI_FAKE_LATENCY_MS'],
+                         'sigma': app.config['AI_FAKE_LATENCY_SIGMA'],
+                         'tokens': app.config['AI_FAKE_TOKENS'],
+                         'tokens_per_second': app.config['AI_FAKE_TOKENS_PER_SECOND'],
+                         'error_rate': app.config['AI_FAKE_ERROR_RATE'],
+                         'seed': app.config['AI_FAKE_SEED']
+                     },
+                     deadline=app.config['AI_DEADLINE'],
+                     retries=app.config['AI_RETRIES'],
+                     backoff=app.config['AI_RETRY_BACKOFF'],
+                     hedge_after=app.config['AI_HEDGE_AFTER'])
+    ai_breaker.configure(failure_threshold=app.config['AI_BREAKER_THRESHOLD'],
+                         reset_timeout=app.config['AI_BREAKER_RESET'])
+    metrics.register('ai_provider', ai_usage.stats)
+    metrics.register('ai_breaker', ai_breaker.stats)
+    if app.config['AI_WARMUP']:
+        socketio.start_background_task(warm_up)
+
+    # Write-behind message buffer
+    from .models import Message as MessageModel, ChatSession as ChatSessionModel
+    from .utils.message_buffer import message_buffer
+    message_buffer.configure(app, socketio, MessageModel.__table__,
+                             enabled=app.config['MESSAGE_BUFFER_ENABLED'],
+                             batch_size=app.config['MESSAGE_BUFFER_BATCH'],
+                             interval=app.config['MESSAGE_BUFFER_INTERVAL_MS'] / 1000,
+                             max_pending=app.config['MESSAGE_BUFFER_MAX_PENDING'],
+                             max_attempts=app.config['MESSAGE_BUFFER_MAX_ATTEMPTS'],
+                             sessions_table=ChatSessionModel.__table__)
+    metrics.register('message_buffer', message_buffer.stats)
+
     # Login Manager
     login_manager = LoginManager()
     login_manager.init_app(app)
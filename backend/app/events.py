@@ -1,16 +1,39 @@
 from flask import request
+from flask_login import current_user
 from flask_socketio import emit, join_room, leave_room
 from . import socketio
-from .services import validate_session_access, save_message
+from .services import (
+    validate_session_access, queue_message, get_messages_since,
+    get_chat_session, get_creator_inbox, notify_creator_inbox
+)
+
+def _replay_missed(session_id, last_seq):
+    """
+    Sends the requesting client the messages after last_seq, as regular
+    `message` events; `resync_required` when too many were missed.
+    """
+    try:
+        last_seq = int(last_seq)
+    except (TypeError, ValueError):
+        emit('error', {'msg': 'last_seq inválido'})
+        return
+    messages, complete = get_messages_since(session_id, last_seq)
+    if not complete:
+        emit('resync_required', {'session_id': session_id})
+        return
+    for m in messages:
+        emit('message', {'user_id': m.sender_id, 'content': m.content, 'seq': m.seq})
 
 @socketio.on('join')
 def on_join(data):
     """
-    Client joins a chat session room.
-    Data: { 'session_id': int, 'user_id': int }
+    Client joins a chat session room. On reconnect it sends the last seq it
+    saw and only the missed messages are replayed.
+    Data: { 'session_id': int, 'user_id': int, 'last_seq': int (optional) }
     """
     session_id = data.get('session_id')
     user_id = data.get('user_id')
+    last_seq = data.get('last_seq')
     
     if user_id:
         try:
@@ -27,9 +50,52 @@ def on_join(data):
         room = f"session_{session_id}"
         join_room(room)
         emit('status', {'msg': f'User {user_id} has entered the room.'}, room=room)
+        # After join_room, so nothing falls between the replay and live emits
+        if last_seq is not None:
+            _replay_missed(session_id, last_seq)
     else:
         emit('error', {'msg': 'Unauthorized access to this session.'})
 
+@socketio.on('join_inbox')
+def on_join_inbox(data=None):
+    """
+    Creator subscribes to the support inbox of their chatbots and gets the
+    current snapshot; changes then arrive as inbox_upsert / inbox_remove /
+    inbox_message. Rejoining (e.g. on reconnect) resends the snapshot.
+    The creator is the logged-in user of the socket's session, never an id
+    from the payload.
+    """
+    if not current_user.is_authenticated or current_user.role != 'creator':
+        emit('error', {'msg': 'No autorizado'})
+        return
+    user_id = current_user.id
+    # Join first so no delta falls between the snapshot and the room
+    join_room(f"creator_{user_id}")
+    emit('inbox_snapshot', {'sessions': get_creator_inbox(user_id)})
+
+@socketio.on('resync')
+def on_resync(data):
+    """
+    Client asks for the messages it missed.
+    Data: { 'session_id': int, 'user_id': int, 'last_seq': int }
+    """
+    session_id = data.get('session_id')
+    user_id = data.get('user_id')
+    
+    if user_id:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            pass
+
+    if not session_id or not user_id:
+        return
+
+    if validate_session_access(session_id, user_id):
+        _replay_missed(session_id, data.get('last_seq'))
+    else:
+        emit('error', {'msg': 'Unauthorized'})
+
 @socketio.on('message')
 def on_message(data):
     """
@@ -52,12 +118,16 @@ def on_message(data):
     # Validate again to be safe (though usually done on join)
     try:
         if validate_session_access(session_id, user_id):
-            # 1. Save to DB
-            save_message(session_id, user_id, content)
-            
-            # 2. Emit to Room (Real-time)
             room = f"session_{session_id}"
-            emit('message', {'user_id': user_id, 'content': content}, room=room)
+
+            # 2. Emit to Room once stored (with the write-behind buffer on,
+            # after the batch that numbers it)
+            def deliver(seq):
+                socketio.emit('message', {'user_id': user_id, 'content': content, 'seq': seq}, room=room)
+                notify_creator_inbox(get_chat_session(session_id), 'message', seq=seq)
+
+            # 1. Save to DB (or queue it when the write-behind buffer is on)
+            queue_message(session_id, user_id, content, on_saved=deliver)
         else:
             emit('error', {'msg': 'Unauthorized'})
     except Exception as e:
@@ -85,11 +155,12 @@ def on_request_human(data):
     try:
         if validate_session_access(session_id, user_id):
             from .services import switch_session_to_human
-            switch_session_to_human(session_id)
+            session = switch_session_to_human(session_id)
             
             room = f"session_{session_id}"
             emit('status', {'msg': 'Human support requested. Waiting for an agent...'}, room=room)
             emit('session_updated', {'type': 'human_support'}, room=room)
+            notify_creator_inbox(session, 'upsert')
         else:
             emit('error', {'msg': 'Unauthorized'})
     except Exception as e:
@@ -117,11 +188,12 @@ def on_cancel_human(data):
     try:
         if validate_session_access(session_id, user_id):
             from .services import switch_session_to_ai
-            switch_session_to_ai(session_id)
+            session = switch_session_to_ai(session_id)
             
             room = f"session_{session_id}"
             emit('status', {'msg': 'Solicitud de ayuda humana cancelada. Volviendo a modo IA.'}, room=room)
             emit('session_updated', {'type': 'ai_conversation'}, room=room)
+            notify_creator_inbox(session, 'remove')
         else:
             emit('error', {'msg': 'No autorizado'})
     except Exception as e:
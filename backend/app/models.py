@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime, timezone
 from sqlalchemy import Enum
+from .utils.tree_parser import PATH_MAX_LENGTH
 
 db = SQLAlchemy()
 
@@ -34,6 +35,10 @@ class Chatbot(db.Model):
     description = db.Column(db.Text)
     visibility = db.Column(visibility_enum, default='private', nullable=False)
     is_active = db.Column(db.Boolean, default=True)
+    # Bumped on every update; keys the in-process snapshot cache
+    version = db.Column(db.Integer, default=1, nullable=False)
+    # Per-chatbot AI tuning (retrieval_top_k, context_token_budget); missing keys use app defaults
+    ai_settings = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     nodes = db.relationship('Node', backref='chatbot', lazy=True, cascade="all, delete-orphan")
@@ -46,7 +51,21 @@ class Node(db.Model):
     chatbot_id = db.Column(db.Integer, db.ForeignKey('chatbots.id'), nullable=False)
     label = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text)
+    # Derived from content when the tree is saved: plain text (prompts, search)
+    # and a short preview (content-less tree views)
+    content_text = db.Column(db.Text, nullable=True)
+    summary = db.Column(db.String(255), nullable=True)
     parent_node_id = db.Column(db.Integer, db.ForeignKey('nodes.id'), nullable=True)
+    # Order among siblings, so in-place tree edits keep the submitted order
+    position = db.Column(db.Integer, default=0, nullable=False)
+    # Materialized path of zero-padded ancestor ids (root first, self last) and depth (root = 0)
+    path = db.Column(db.String(PATH_MAX_LENGTH), nullable=True)
+    depth = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_nodes_chatbot_path', 'chatbot_id', 'path'),
+        db.Index('ix_nodes_parent_position', 'parent_node_id', 'position', 'id'),
+    )
 
     children = db.relationship(
         'Node',
@@ -63,6 +82,11 @@ class ChatSession(db.Model):
     type = db.Column(session_types_enum, nullable=False)
     status = db.Column(session_status_enum, default='active', nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Rolling summary of the messages up to summary_message_id (AI prompts)
+    summary = db.Column(db.Text, nullable=True)
+    summary_message_id = db.Column(db.Integer, nullable=True)
+    # Last sequence number handed out to a message of this session
+    last_seq = db.Column(db.Integer, default=0, nullable=False)
 
     messages = db.relationship('Message', backref='chat_session', lazy=True, cascade="all, delete-orphan")
 
@@ -75,3 +99,12 @@ class Message(db.Model):
     sender_type = db.Column(sender_types_enum, nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Per-session order (1, 2, ...), sent with every emitted message so
+    # reconnecting clients can ask for what they missed
+    seq = db.Column(db.Integer, nullable=True)
+
+    # History is read per session in (created_at, id) order, replays by seq
+    __table_args__ = (
+        db.Index('ix_messages_session_created', 'chat_session_id', 'created_at', 'id'),
+        db.Index('ux_messages_session_seq', 'chat_session_id', 'seq', unique=True),
+    )
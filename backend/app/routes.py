@@ -1,5 +1,7 @@
 
-from flask import Blueprint, request, jsonify
+import hmac
+import json
+from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_user, logout_user, current_user, login_required
 from .services import (
     register_user, authenticate_user, 
@@ -31,11 +33,30 @@ from .services import (
     register_user, authenticate_user, 
     create_chatbot, get_chatbot, get_chatbot_tree, list_chatbots, delete_chatbot, 
     create_chatbot, get_chatbot, get_chatbot_tree, list_chatbots, delete_chatbot, 
-    create_chat_session, ask_chatbot_session, get_creator_sessions, get_session_messages, update_chatbot
+    create_chat_session, ask_chatbot_session, get_creator_sessions, get_session_messages, update_chatbot,
+    get_chatbot_snapshot, get_node_children, get_chatbot_version, list_chatbots_etag,
+    get_session_messages_etag, get_session_message_page, get_creator_inbox
 )
+from .utils.metrics import metrics
 
 main = Blueprint('main', __name__)
 
+def _not_modified(etag, cache_control='no-cache'):
+    """
+    Returns a 304 response when the client's If-None-Match already matches
+    `etag`, so the caller can skip building and serializing the body.
+    """
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        return _with_etag(response, etag, cache_control)
+    return None
+
+def _with_etag(response, etag, cache_control='no-cache'):
+    response.set_etag(etag)
+    # Clients may store the response but must revalidate it on every use
+    response.headers['Cache-Control'] = cache_control
+    return response
+
 @main.route('/auth/register', methods=['POST'])
 def register():
     data = request.json
@@ -95,24 +116,47 @@ def create_chat_session_route():
 @main.route('/chat-sessions/<int:session_id>/messages', methods=['GET'])
 @login_required
 def get_session_messages_route(session_id):
+    """
+    History page: ?limit=1..200 (latest messages), ?before=<prev_cursor>, ?after=<next_cursor>
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Parámetros inválidos'}), 400
+    before = request.args.get('before')
+    after = request.args.get('after')
+
     try:
         # Validate access
         if not validate_session_access(session_id, current_user.id):
             return jsonify({'success': False, 'error': 'No autorizado'}), 403
-            
-        messages = get_session_messages(session_id)
-        return jsonify({
+
+        etag = get_session_messages_etag(session_id, limit, before, after)
+        not_modified = _not_modified(etag, 'private, no-cache')
+        if not_modified:
+            return not_modified
+
+        page = get_session_message_page(session_id, limit=limit, before=before, after=after)
+        response = jsonify({
             'success': True, 
             'messages': [{
                 'content': m.content,
                 'sender_type': m.sender_type,
-                'created_at': m.created_at.isoformat()
-            } for m in messages]
-        }), 200
+                'created_at': m.created_at.isoformat(),
+                'seq': m.seq
+            } for m in page['messages']],
+            'prev_cursor': page['prev_cursor'],
+            'next_cursor': page['next_cursor']
+        })
+        return _with_etag(response, etag, 'private, no-cache'), 200
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': 'Error interno del servidor'}), 500
 
-from .services import ask_chatbot_session, validate_session_access
+from .services import ask_chatbot_session, validate_session_access, submit_ai_question, get_ai_job
+from .utils.jobs import ai_jobs, QueueFullError
+from .utils.ai_client import AIProviderError
 
 @main.route('/chat-sessions/<int:session_id>/ask', methods=['POST'])
 def ask_session_ai_route(session_id):
@@ -138,14 +182,48 @@ def ask_session_ai_route(session_id):
              
         # TODO: Check if current_user is the owner of the session
         
-        response = ask_chatbot_session(session_id, current_node_id, query)
+        stream = bool(data.get('stream'))
+        if ai_jobs.enabled:
+            job = submit_ai_question(session_id, current_user.id, current_node_id, query, stream=stream)
+            # The answer arrives through the room `message` event
+            return jsonify({'success': True, 'job_id': job['id'], 'status': job['status']}), 202
+
+        response = ask_chatbot_session(session_id, current_node_id, query, stream=stream)
         return jsonify({'success': True, 'response': response}), 200
+    except QueueFullError:
+        response = jsonify({'success': False, 'error': 'El asistente está ocupado, inténtalo de nuevo en unos segundos'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    except AIProviderError as e:
+        # Nothing is saved or broadcast; the client decides whether to retry
+        response = jsonify({'success': False, 'error': str(e), **e.to_dict()})
+        response.headers['Retry-After'] = str(e.retry_after or 5)
+        return response, 503
     except ValueError as e:
         return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         print(f"AI SESSION ERROR: {e}")
         return jsonify({'success': False, 'error': 'Error interno del servidor'}), 500
 
+@main.route('/ai-jobs/<job_id>', methods=['GET'])
+def get_ai_job_route(job_id):
+    if not current_user.is_authenticated:
+        return jsonify({'success': False, 'error': 'No autorizado'}), 401
+
+    job = get_ai_job(job_id, current_user.id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({
+        'success': True,
+        'job': {
+            'id': job['id'],
+            'status': job['status'],
+            'response': job.get('result'),
+            'error': job.get('error'),
+            'failure': job.get('failure')
+        }
+    }), 200
+
 @main.route('/chatbots', methods=['POST'])
 def create_chatbot_route():
     data = request.json
@@ -163,7 +241,8 @@ def create_chatbot_route():
             data.get('title'), 
             data.get('description'), 
             data.get('visibility'), 
-            data.get('tree_json')
+            data.get('tree_json'),
+            data.get('ai_settings')
         )
         return jsonify({'success': True, 'msg': 'Chatbot creado', 'id': chatbot.id}), 201
     except ValueError as e:
@@ -173,32 +252,68 @@ def create_chatbot_route():
 
 @main.route('/chatbots/<int:chatbot_id>', methods=['GET'])
 def get_chatbot_route(chatbot_id):
-    chatbot = get_chatbot(chatbot_id)
-    if not chatbot:
+    version = get_chatbot_version(chatbot_id)
+    if version is None:
         return jsonify({'success': False, 'error': 'Chatbot no encontrado'}), 404
-    
-    tree = get_chatbot_tree(chatbot_id)
-    
-    return jsonify({
-        'success': True,
-        'chatbot': {
-            'id': chatbot.id,
-            'title': chatbot.title,
-            'description': chatbot.description,
-            'visibility': chatbot.visibility,
-            'creator_id': chatbot.creator_id
-        },
-        'tree': tree
-    }), 200
+
+    etag = f"chatbot-{chatbot_id}-v{version}"
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    snapshot = get_chatbot_snapshot(chatbot_id, version)
+
+    # The tree is already serialized in the snapshot; only the envelope is encoded here
+    body = b''.join([
+        b'{"success":true,"chatbot":',
+        json.dumps(snapshot.metadata(), separators=(',', ':')).encode('utf-8'),
+        b',"tree":',
+        snapshot.tree_bytes,
+        b'}'
+    ])
+    response = current_app.response_class(body, status=200, mimetype='application/json')
+    return _with_etag(response, etag)
+
+@main.route('/chatbots/<int:chatbot_id>/nodes', methods=['GET'])
+@main.route('/chatbots/<int:chatbot_id>/nodes/<int:node_id>', methods=['GET'])
+def get_chatbot_nodes_route(chatbot_id, node_id=None):
+    """
+    Lazy tree loading: ?depth=1..3, ?limit=1..200, ?cursor=<next_cursor>, ?content=0
+    """
+    try:
+        depth = min(max(int(request.args.get('depth', 1)), 1), 3)
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Parámetros inválidos'}), 400
+    include_content = request.args.get('content', '1').lower() not in ('0', 'false', 'no')
+
+    try:
+        node = get_node_children(
+            chatbot_id, node_id,
+            depth=depth, limit=limit,
+            cursor=request.args.get('cursor'),
+            include_content=include_content
+        )
+        return jsonify({'success': True, 'node': node}), 200
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
 
 @main.route('/chatbots', methods=['GET'])
 def list_chatbots_route():
     search = request.args.get('search')
+    etag = list_chatbots_etag(search)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
     chatbots = list_chatbots(search)
-    return jsonify({
+    response = jsonify({
         'success': True,
         'chatbots': [{'id': c.id, 'title': c.title, 'description': c.description, 'creator_id': c.creator_id} for c in chatbots]
-    }), 200
+    })
+    return _with_etag(response, etag), 200
 
 @main.route('/chatbots/<int:chatbot_id>', methods=['DELETE'])
 def delete_chatbot_route(chatbot_id):
@@ -219,16 +334,10 @@ def list_creator_sessions_route():
     if current_user.role != 'creator':
         return jsonify({'success': False, 'error': 'No autorizado'}), 403
         
-    sessions = get_creator_sessions(current_user.id)
-    
+    # Same snapshot the `join_inbox` socket event sends
     return jsonify({
         'success': True,
-        'sessions': [{
-            'id': s.id,
-            'chatbot_title': s.chatbot.title,
-            'user_id': s.user_id, # Could fetch username if needed
-            'created_at': s.created_at.isoformat()
-        } for s in sessions]
+        'sessions': get_creator_inbox(current_user.id)
     }), 200
 
 from .services import resolve_chat_session
@@ -255,7 +364,8 @@ def update_chatbot_route(chatbot_id):
             data.get('title'),
             data.get('description'),
             data.get('visibility'),
-            data.get('tree_json')
+            data.get('tree_json'),
+            data.get('ai_settings')
         )
         return jsonify({'success': True, 'msg': 'Chatbot actualizado'}), 200
     except ValueError as e:
@@ -263,3 +373,16 @@ def update_chatbot_route(chatbot_id):
     except Exception as e:
         print(f"UPDATE ERROR: {e}")
         return jsonify({'success': False, 'error': 'Error interno del servidor'}), 500
+
+@main.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Runtime metrics for logged-in users, or for scrapers sending
+    `Authorization: Bearer <METRICS_TOKEN>` when that token is configured.
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    sent = request.headers.get('Authorization', '')
+    has_token = bool(token) and hmac.compare_digest(sent.encode(), f"Bearer {token}".encode())
+    if not (current_user.is_authenticated or has_token):
+        return jsonify({'success': False, 'error': 'No autorizado'}), 401
+    return jsonify({'success': True, 'metrics': metrics.collect()}), 200
@@ -30,31 +30,79 @@ def authenticate_user(identifier, password):
 
     return user
 
+import hashlib
+from collections import deque
+import math
+import time
+import uuid
+from flask import current_app
+from sqlalchemy import insert, select, update, func, or_, and_
+from sqlalchemy.orm import aliased
 from .models import Chatbot, Node
-from .utils.tree_parser import validate_tree, nodes_to_json
-from .utils.ai_client import generate_response
+from .utils.tree_parser import normalize_tree, TreeValidationError, nodes_to_json, node_path, path_ids, path_upper_bound
+from .utils.cache import chatbot_cache, retrieval_cache, prompt_cache, answer_cache, session_access_cache
+from .utils.text import normalize_query, html_to_text, summarize_text
+from .utils.metrics import metrics, StageTimer
+from .utils.jobs import ai_jobs
+from .utils.singleflight import ai_flights
+from .utils.message_buffer import message_buffer
+from .utils.prompt_builder import compile_prompt, KB_FORMATS
+from .utils.retrieval import ChatbotRetriever
+from .utils.tokens import estimate_tokens, CHARS_PER_TOKEN
+from .utils.snapshots import build_snapshot
+from .utils.ai_client import generate_response, stream_response, AIProviderError
 
-def create_chatbot(user_id, title, description, visibility, tree_json):
+# Per-chatbot AI settings and the values they accept; missing keys fall back
+# to the app-wide defaults in get_ai_settings
+AI_SETTINGS_SCHEMA = {
+    'retrieval_top_k': lambda v: isinstance(v, int) and not isinstance(v, bool) and 1 <= v <= 50,
+    'context_token_budget': lambda v: isinstance(v, int) and not isinstance(v, bool) and 100 <= v <= 100000,
+    'answer_cache': lambda v: isinstance(v, bool),
+    'kb_format': lambda v: v in KB_FORMATS,
+}
+
+def _clean_ai_settings(ai_settings):
+    if ai_settings is None:
+        return None
+    if not isinstance(ai_settings, dict):
+        raise ValueError('Configuración de IA inválida')
+    for key, value in ai_settings.items():
+        check = AI_SETTINGS_SCHEMA.get(key)
+        if check is None or not check(value):
+            raise ValueError(f'Configuración de IA inválida: {key}')
+    return dict(ai_settings)
+
+def get_ai_settings(snapshot):
+    settings = {
+        'retrieval_top_k': current_app.config['AI_RETRIEVAL_TOP_K'],
+        'context_token_budget': current_app.config['AI_CONTEXT_TOKEN_BUDGET'],
+        'answer_cache': current_app.config['ANSWER_CACHE_ENABLED'],
+        'kb_format': current_app.config['AI_KB_FORMAT'],
+    }
+    settings.update(snapshot.ai_settings)
+    return settings
+
+def create_chatbot(user_id, title, description, visibility, tree_json, ai_settings=None):
     if not (title and visibility):
         raise ValueError('Faltan campos requeridos')
     
-    # Validate tree
-    if tree_json:
-        if not validate_tree(tree_json):
-             raise ValueError("Formato de árbol inválido")
+    # Validate and normalize tree in a single bounded pass
+    levels = _normalize_tree_json(tree_json) if tree_json else None
+    ai_settings = _clean_ai_settings(ai_settings)
 
     try:
         new_chatbot = Chatbot(
             creator_id=user_id,
             title=title,
             description=description,
-            visibility=visibility
+            visibility=visibility,
+            ai_settings=ai_settings
         )
         db.session.add(new_chatbot)
         db.session.flush() # Get ID
 
-        if tree_json:
-            _save_tree_nodes(new_chatbot.id, tree_json)
+        if levels:
+            _save_tree_nodes(new_chatbot.id, levels)
 
         db.session.commit()
         return new_chatbot
@@ -62,31 +110,440 @@ def create_chatbot(user_id, title, description, visibility, tree_json):
         db.session.rollback()
         raise e
 
-def _save_tree_nodes(chatbot_id, tree_data, parent_id=None):
-    node = Node(
-        chatbot_id=chatbot_id,
-        label=tree_data['label'],
-        parent_node_id=parent_id,
-        content=tree_data.get('content', '') # Save content if present
-    )
-    db.session.add(node)
-    db.session.flush()
+def _normalize_tree_json(tree_json):
+    limits = {
+        'max_nodes': current_app.config.get('TREE_MAX_NODES'),
+        'max_depth': current_app.config.get('TREE_MAX_DEPTH'),
+        'max_label_length': current_app.config.get('TREE_MAX_LABEL_LENGTH'),
+        'max_content_length': current_app.config.get('TREE_MAX_CONTENT_LENGTH'),
+    }
+    try:
+        return normalize_tree(tree_json, **limits)
+    except TreeValidationError as e:
+        raise ValueError(f"Formato de árbol inválido: {e}")
+
+def _content_columns(content):
+    """
+    Derived columns of a node's HTML content, computed once at write time.
+    """
+    text = html_to_text(content)
+    return {'content_text': text, 'summary': summarize_text(text)}
 
-    for child in tree_data.get('children', []):
-        _save_tree_nodes(chatbot_id, child, node.id)
+def _save_tree_nodes(chatbot_id, levels):
+    """
+    Inserts a normalized tree (see normalize_tree) level by level: one
+    multi-row INSERT per depth instead of one flush per node, followed by one
+    UPDATE filling in the materialized paths of that level.
+    """
+    parent_ids, parent_paths = [], []
+    for depth, level in enumerate(levels):
+        new_ids = db.session.scalars(
+            insert(Node).returning(Node.id, sort_by_parameter_order=True),
+            [{
+                'chatbot_id': chatbot_id,
+                'label': rec['label'],
+                'parent_node_id': parent_ids[rec['parent']] if rec['parent'] is not None else None,
+                'position': rec['position'],
+                'depth': depth,
+                'content': rec['content'],
+                **_content_columns(rec['content'])
+            } for rec in level]
+        ).all()
+
+        paths = [
+            node_path(parent_paths[rec['parent']] if rec['parent'] is not None else '', node_id)
+            for rec, node_id in zip(level, new_ids)
+        ]
+        db.session.execute(update(Node), [
+            {'id': node_id, 'path': path} for node_id, path in zip(new_ids, paths)
+        ])
+        parent_ids, parent_paths = new_ids, paths
 
 def get_chatbot(chatbot_id):
     return db.session.get(Chatbot, chatbot_id)
 
+def _match_children(submitted, existing, claimed, existing_by_id):
+    """
+    Pairs submitted children with stored nodes: explicit id first (allows
+    moves), then same label among the stored siblings, then same position.
+    Returns a list of stored nodes (or None) aligned with `submitted`.
+    """
+    matches = [None] * len(submitted)
+
+    for i, data in enumerate(submitted):
+        node = existing_by_id.get(data.get('id'))
+        if node is not None and node.id not in claimed:
+            matches[i] = node
+            claimed.add(node.id)
+
+    by_label = {}
+    for n in existing:
+        if n.id not in claimed:
+            by_label.setdefault(n.label, deque()).append(n)
+    for i, data in enumerate(submitted):
+        if matches[i] is None:
+            candidates = by_label.get(data['label'])
+            while candidates and candidates[0].id in claimed:
+                candidates.popleft()
+            if candidates:
+                node = candidates.popleft()
+                matches[i] = node
+                claimed.add(node.id)
+
+    for i, data in enumerate(submitted):
+        if matches[i] is None and i < len(existing) and existing[i].id not in claimed:
+            matches[i] = existing[i]
+            claimed.add(existing[i].id)
+
+    return matches
+
+def _sync_tree_nodes(chatbot_id, levels):
+    """
+    Diffs a normalized tree against the stored nodes and issues only the
+    needed inserts, updates, moves and deletes. Returns a dict of counts.
+    """
+    stored = Node.query.filter_by(chatbot_id=chatbot_id).order_by(Node.position, Node.id).all()
+    existing_by_id = {n.id: n for n in stored}
+    stored_children = {}
+    for n in stored:
+        stored_children.setdefault(n.parent_node_id, []).append(n)
+
+    claimed = set()
+    updates = {}
+    stats = {'inserted': 0, 'updated': 0, 'moved': 0, 'deleted': 0, 'unchanged': 0}
+
+    # refs[d][i] is the final id of levels[d][i]: a stored id, or a [id] cell
+    # filled once the new node is inserted
+    refs = []
+    matches = _match_children(levels[0], stored_children.get(None, []), claimed, existing_by_id)
+    for depth, level in enumerate(levels):
+        next_level = levels[depth + 1] if depth + 1 < len(levels) else []
+        next_matches = [None] * len(next_level)
+        level_refs = []
+        for rec, node in zip(level, matches):
+            parent_ref = refs[-1][rec['parent']] if rec['parent'] is not None else None
+            if node is None:
+                level_refs.append([None])
+                children_existing = []
+            else:
+                level_refs.append(node.id)
+                changes = {}
+                if node.label != rec['label']:
+                    changes['label'] = rec['label']
+                if (node.content or '') != rec['content']:
+                    changes['content'] = rec['content']
+                if 'content' in changes or node.content_text is None:
+                    changes.update(_content_columns(rec['content']))
+                if node.position != rec['position']:
+                    changes['position'] = rec['position']
+                if node.parent_node_id != parent_ref or isinstance(parent_ref, list):
+                    changes['parent_node_id'] = parent_ref
+                    stats['moved'] += 1
+                elif changes:
+                    stats['updated'] += 1
+                else:
+                    stats['unchanged'] += 1
+                if changes:
+                    updates[node.id] = changes
+                children_existing = stored_children.get(node.id, [])
+
+            children = [next_level[j] for j in rec['children']]
+            for j, match in zip(rec['children'], _match_children(children, children_existing, claimed, existing_by_id)):
+                next_matches[j] = match
+        refs.append(level_refs)
+        matches = next_matches
+
+    def resolve(ref):
+        return ref[0] if isinstance(ref, list) else ref
+
+    # 1. Inserts, one multi-row statement per depth (parents resolve top-down)
+    for depth, level in enumerate(levels):
+        new_nodes = [(rec, ref) for rec, ref in zip(level, refs[depth]) if isinstance(ref, list)]
+        if not new_nodes:
+            continue
+        new_ids = db.session.scalars(
+            insert(Node).returning(Node.id, sort_by_parameter_order=True),
+            [{
+                'chatbot_id': chatbot_id,
+                'label': rec['label'],
+                'parent_node_id': resolve(refs[depth - 1][rec['parent']]) if rec['parent'] is not None else None,
+                'position': rec['position'],
+                'depth': depth,
+                'content': rec['content'],
+                **_content_columns(rec['content'])
+            } for rec, _ in new_nodes]
+        ).all()
+        for (_, ref), node_id in zip(new_nodes, new_ids):
+            ref[0] = node_id
+        stats['inserted'] += len(new_ids)
+
+    # 2. Materialized paths: recomputed top-down, so moved subtrees follow their root
+    parent_paths = []
+    for depth, level in enumerate(levels):
+        paths = []
+        for rec, ref in zip(level, refs[depth]):
+            node_id = resolve(ref)
+            path = node_path(parent_paths[rec['parent']] if rec['parent'] is not None else '', node_id)
+            paths.append(path)
+            node = existing_by_id.get(node_id) if not isinstance(ref, list) else None
+            if node is None or node.path != path or node.depth != depth:
+                updates.setdefault(node_id, {}).update({'path': path, 'depth': depth})
+        parent_paths = paths
+
+    # 3. Updates and moves, now that every parent id is known
+    if updates:
+        rows = []
+        for node_id, changes in updates.items():
+            if 'parent_node_id' in changes:
+                changes['parent_node_id'] = resolve(changes['parent_node_id'])
+            rows.append({'id': node_id, **changes})
+        for keys in {tuple(sorted(r)) for r in rows}:
+            db.session.execute(update(Node), [r for r in rows if tuple(sorted(r)) == keys])
+
+    # 4. Deletes: unlink first to satisfy the self-referencing foreign key
+    stale_ids = [n.id for n in stored if n.id not in claimed]
+    if stale_ids:
+        Node.query.filter(Node.id.in_(stale_ids)).update({Node.parent_node_id: None}, synchronize_session=False)
+        Node.query.filter(Node.id.in_(stale_ids)).delete(synchronize_session=False)
+        stats['deleted'] = len(stale_ids)
+
+    db.session.expire_all()
+    return stats
+
+def get_chatbot_version(chatbot_id):
+    return db.session.scalar(select(Chatbot.version).where(Chatbot.id == chatbot_id))
+
+def get_chatbot_snapshot(chatbot_id, version=None):
+    """
+    Returns the cached ChatbotSnapshot for the chatbot's current version,
+    rebuilding it from the database on a miss. Only the version column is
+    read on a hit (nothing, if the caller already knows the version).
+    """
+    if version is None:
+        version = get_chatbot_version(chatbot_id)
+    if version is None:
+        return None
+
+    snapshot = chatbot_cache.get((chatbot_id, version))
+    if snapshot is not None:
+        return snapshot
+
+    chatbot = db.session.get(Chatbot, chatbot_id)
+    nodes = Node.query.filter_by(chatbot_id=chatbot_id).order_by(Node.position, Node.id).all()
+    snapshot = build_snapshot(chatbot, nodes)
+    chatbot_cache.set((chatbot_id, snapshot.version), snapshot)
+    return snapshot
+
+def invalidate_chatbot_snapshot(chatbot_id):
+    for cache in (chatbot_cache, retrieval_cache, prompt_cache, answer_cache):
+        cache.pop_matching(lambda key: key[0] == chatbot_id)
+
+def get_chatbot_retriever(snapshot):
+    """
+    BM25 retriever for a snapshot, built once per chatbot version.
+    """
+    key = (snapshot.id, snapshot.version)
+    retriever = retrieval_cache.get(key)
+    if retriever is None:
+        retriever = ChatbotRetriever(snapshot.tree, snapshot.node_texts)
+        retrieval_cache.set(key, retriever)
+    return retriever
+
+def get_compiled_prompt(snapshot, retriever):
+    """
+    Static prompt prefix and pre-rendered knowledge-base entries, compiled
+    once per chatbot version and knowledge-base format.
+    """
+    kb_format = get_ai_settings(snapshot)['kb_format']
+    key = (snapshot.id, snapshot.version, kb_format)
+    compiled = prompt_cache.get(key)
+    if compiled is None:
+        compiled = compile_prompt(snapshot, retriever, kb_format)
+        prompt_cache.set(key, compiled)
+    return compiled
+
 def get_chatbot_tree(chatbot_id):
+    snapshot = get_chatbot_snapshot(chatbot_id)
+    return snapshot.tree if snapshot else None
+
+def get_node_ancestors(node):
+    """
+    Returns the ancestor chain of `node` (a Node or its id), root first and
+    including the node itself, with a single primary-key lookup on its path.
+    """
+    if not isinstance(node, Node):
+        node = db.session.get(Node, node)
+    if node is None or not node.path:
+        return []
+    ids = path_ids(node.path)
+    by_id = {n.id: n for n in Node.query.filter(Node.id.in_(ids)).all()}
+    return [by_id[i] for i in ids if i in by_id]
+
+def get_node_subtree(node, max_depth=None):
+    """
+    Returns the nested subtree rooted at `node` (a Node or its id), limited to
+    `max_depth` levels below it, using one range scan on (chatbot_id, path).
+    """
+    if not isinstance(node, Node):
+        node = db.session.get(Node, node)
+    if node is None or not node.path:
+        return None
+    query = Node.query.filter(
+        Node.chatbot_id == node.chatbot_id,
+        Node.path >= node.path,
+        Node.path < path_upper_bound(node.path)
+    )
+    if max_depth is not None:
+        query = query.filter(Node.depth <= node.depth + max_depth)
+    nodes = query.order_by(Node.position, Node.id).all()
+    return nodes_to_json(nodes, root_id=node.id)
+
+def _encode_node_cursor(node):
+    return f"{node.position}.{node.id}"
+
+def _decode_node_cursor(cursor):
+    try:
+        position, node_id = cursor.split('.')
+        return int(position), int(node_id)
+    except (AttributeError, ValueError):
+        raise ValueError('Cursor inválido')
+
+def get_node_children(chatbot_id, node_id=None, depth=1, limit=50, cursor=None, include_content=True):
+    """
+    Lazy view of a chatbot tree: the node (root when node_id is None) with its
+    children expanded `depth` levels. Direct children are paginated with an
+    opaque sibling cursor; deeper levels return their first `limit` children
+    each. Every node carries child_count and, when truncated, next_cursor.
+    """
+    if node_id is None:
+        node = Node.query.filter_by(chatbot_id=chatbot_id, parent_node_id=None).first()
+    else:
+        node = db.session.get(Node, node_id)
+    if node is None or node.chatbot_id != chatbot_id:
+        raise LookupError('Nodo no encontrado')
+
+    def serialize(n):
+        data = {'id': n.id, 'label': n.label}
+        if include_content:
+            data['content'] = n.content
+        else:
+            data['summary'] = n.summary
+        return data
+
+    root = serialize(node)
+    parents = {node.id: root}
+
+    # First level: keyset pagination over (position, id)
+    query = Node.query.filter(Node.parent_node_id == node.id)
+    if cursor:
+        position, last_id = _decode_node_cursor(cursor)
+        query = query.filter(or_(
+            Node.position > position,
+            and_(Node.position == position, Node.id > last_id)
+        ))
+    rows = query.order_by(Node.position, Node.id).limit(limit + 1).all()
+    levels = [[(node.id, rows)]]
+
+    for _ in range(depth - 1):
+        parent_ids = [child.id for _, children in levels[-1] for child in children[:limit]]
+        if not parent_ids:
+            break
+        ranked = select(
+            Node,
+            func.row_number().over(
+                partition_by=Node.parent_node_id,
+                order_by=(Node.position, Node.id)
+            ).label('rank')
+        ).where(Node.parent_node_id.in_(parent_ids)).subquery()
+        ranked_node = aliased(Node, ranked)
+        children = db.session.scalars(
+            select(ranked_node).where(ranked.c.rank <= limit + 1)
+            .order_by(ranked.c.parent_node_id, ranked.c.position, ranked.c.id)
+        ).all()
+        grouped = {}
+        for child in children:
+            grouped.setdefault(child.parent_node_id, []).append(child)
+        levels.append([(pid, grouped.get(pid, [])) for pid in parent_ids])
+
+    returned = [node.id]
+    for level in levels:
+        for parent_id, children in level:
+            parent = parents[parent_id]
+            parent['children'] = []
+            for child in children[:limit]:
+                parents[child.id] = serialize(child)
+                parent['children'].append(parents[child.id])
+                returned.append(child.id)
+            parent['next_cursor'] = _encode_node_cursor(children[limit - 1]) if len(children) > limit else None
+
+    counts = dict(db.session.execute(
+        select(Node.parent_node_id, func.count(Node.id))
+        .where(Node.parent_node_id.in_(returned))
+        .group_by(Node.parent_node_id)
+    ).all())
+    for nid, data in parents.items():
+        data['child_count'] = counts.get(nid, 0)
+
+    return root
+
+def rebuild_node_paths(chatbot_id):
+    """
+    Recomputes path and depth for every node of a chatbot (backfill for rows
+    written before the columns existed).
+    """
     nodes = Node.query.filter_by(chatbot_id=chatbot_id).all()
-    return nodes_to_json(nodes)
+    children = {}
+    for n in nodes:
+        children.setdefault(n.parent_node_id, []).append(n)
 
-def list_chatbots(search_query=None):
-    query = Chatbot.query.filter_by(is_active=True, visibility='public')
+    rows = []
+    level = [(n, '', 0) for n in children.get(None, [])]
+    while level:
+        next_level = []
+        for n, parent_path, depth in level:
+            path = node_path(parent_path, n.id)
+            rows.append({'id': n.id, 'path': path, 'depth': depth})
+            next_level.extend((child, path, depth + 1) for child in children.get(n.id, []))
+        level = next_level
+    if rows:
+        db.session.execute(update(Node), rows)
+    db.session.commit()
+    return len(rows)
+
+def rebuild_node_text(chatbot_id):
+    """
+    Recomputes content_text and summary for every node of a chatbot (backfill
+    for rows written before the columns existed).
+    """
+    rows = [
+        {'id': node_id, **_content_columns(content)}
+        for node_id, content in db.session.query(Node.id, Node.content).filter(Node.chatbot_id == chatbot_id)
+    ]
+    if rows:
+        db.session.execute(update(Node), rows)
+    db.session.commit()
+    invalidate_chatbot_snapshot(chatbot_id)
+    return len(rows)
+
+def _public_chatbots_filter(query, search_query=None):
+    query = query.filter(Chatbot.is_active == True, Chatbot.visibility == 'public')
     if search_query:
         query = query.filter(Chatbot.title.ilike(f'%{search_query}%'))
-    return query.all()
+    return query
+
+def list_chatbots(search_query=None):
+    return _public_chatbots_filter(Chatbot.query, search_query).all()
+
+def list_chatbots_etag(search_query=None):
+    """
+    Strong validator for the public listing, computed from (id, version)
+    pairs only: changes whenever a listed chatbot is added, removed or updated.
+    """
+    rows = _public_chatbots_filter(
+        db.session.query(Chatbot.id, Chatbot.version), search_query
+    ).order_by(Chatbot.id).all()
+    digest = hashlib.sha1(repr([tuple(r) for r in rows]).encode('utf-8')).hexdigest()
+    return f"chatbots-{digest}"
 
 def delete_chatbot(chatbot_id, user_id):
     chatbot = db.session.get(Chatbot, chatbot_id)
@@ -97,8 +554,10 @@ def delete_chatbot(chatbot_id, user_id):
     
     db.session.delete(chatbot)
     db.session.commit()
+    invalidate_chatbot_snapshot(chatbot_id)
+    invalidate_session_access(chatbot_id=chatbot_id)
 
-def update_chatbot(chatbot_id, user_id, title, description, visibility, tree_json=None):
+def update_chatbot(chatbot_id, user_id, title, description, visibility, tree_json=None, ai_settings=None):
     chatbot = db.session.get(Chatbot, chatbot_id)
     if not chatbot:
         raise ValueError('Chatbot no encontrado')
@@ -110,28 +569,23 @@ def update_chatbot(chatbot_id, user_id, title, description, visibility, tree_jso
         raise ValueError('Faltan campos requeridos')
 
     # Validate tree if provided
-    if tree_json:
-        if not validate_tree(tree_json):
-             raise ValueError("Formato de árbol inválido")
+    levels = _normalize_tree_json(tree_json) if tree_json else None
+    ai_settings = _clean_ai_settings(ai_settings)
 
     try:
         chatbot.title = title
         chatbot.description = description
         chatbot.visibility = visibility
+        if ai_settings is not None:
+            chatbot.ai_settings = ai_settings
+        chatbot.version = (chatbot.version or 0) + 1
         
-        if tree_json:
-            # Delete existing nodes
-            # First, unlink all nodes to avoid foreign key constraints (self-referencing)
-            Node.query.filter_by(chatbot_id=chatbot_id).update({Node.parent_node_id: None})
-            db.session.flush()
-            
-            # Now delete them
-            Node.query.filter_by(chatbot_id=chatbot_id).delete()
-            db.session.flush()
-            # Save new nodes
-            _save_tree_nodes(chatbot.id, tree_json)
+        if levels:
+            # Apply only the node-level changes so unchanged nodes keep their IDs
+            _sync_tree_nodes(chatbot.id, levels)
 
         db.session.commit()
+        invalidate_chatbot_snapshot(chatbot_id)
         return chatbot
     except Exception as e:
         db.session.rollback()
@@ -165,27 +619,81 @@ def create_chat_session(chatbot_id, user_id, session_type='ai_conversation'):
 def get_chat_session(session_id):
     return db.session.get(ChatSession, session_id)
 
+def _run_ai_job(session_id, current_node_id, query, stream):
+    from . import socketio
+    try:
+        return ask_chatbot_session(session_id, current_node_id, query, stream=stream)
+    except Exception as e:
+        # The request already returned 202, so failures are reported to the room
+        payload = {'error': str(e) if isinstance(e, (ValueError, AIProviderError)) else 'Error interno del servidor'}
+        if isinstance(e, AIProviderError):
+            payload.update(e.to_dict())
+        socketio.emit('ai_error', payload, room=f"session_{session_id}")
+        raise
+
+def submit_ai_question(session_id, user_id, current_node_id, query, stream=False):
+    """
+    Queues an AI answer on the worker pool and returns the job record.
+    The answer is delivered through the room `message` event; raises
+    QueueFullError when the queue is at capacity.
+    """
+    if not get_chat_session(session_id):
+        raise ValueError("Sesión no encontrada")
+    return ai_jobs.submit(_run_ai_job, session_id, current_node_id, query, stream, owner_id=user_id)
+
+def get_ai_job(job_id, user_id):
+    """
+    Returns the job record if it exists and belongs to the user, else None.
+    """
+    job = ai_jobs.get(job_id)
+    if not job or job.get('owner_id') != user_id:
+        return None
+    return job
+
 def get_creator_sessions(creator_id):
     return ChatSession.query.join(Chatbot).filter(Chatbot.creator_id == creator_id).all()
 
 def validate_session_access(session_id, user_id):
     """
     Checks if the user is a participant (User or Creator) of the session.
+    Participants are cached per session (see invalidate_session_access).
     """
-    session = get_chat_session(session_id)
-    if not session:
-        return False
-    
-    # Check if user is the session starter
-    if session.user_id == user_id:
-        return True
-        
-    # Check if user is the creator of the chatbot
-    chatbot = get_chatbot(session.chatbot_id)
-    if chatbot and chatbot.creator_id == user_id:
-        return True
-        
-    return False
+    participants = session_access_cache.get(session_id)
+    if participants is None:
+        session = get_chat_session(session_id)
+        if not session:
+            return False
+        chatbot = get_chatbot_snapshot(session.chatbot_id)
+        participants = (session.chatbot_id, session.user_id, chatbot.creator_id if chatbot else None)
+        session_access_cache.set(session_id, participants)
+
+    # Session starter or creator of the chatbot
+    _, starter_id, creator_id = participants
+    return user_id is not None and user_id in (starter_id, creator_id)
+
+def invalidate_session_access(session_id=None, chatbot_id=None):
+    """
+    Drops cached participants of one session, or of every session of a
+    chatbot (deleted, or moved to another owner).
+    """
+    if session_id is not None:
+        session_access_cache.pop(session_id)
+    if chatbot_id is not None:
+        session_access_cache.pop_where(lambda key, participants: participants[0] == chatbot_id)
+
+def _reserve_message_seq(session_id):
+    """
+    Next sequence number of a session's messages. The row update is atomic,
+    so concurrent writers (and other workers) never get the same number;
+    the caller commits.
+    """
+    return db.session.execute(
+        update(ChatSession)
+        .where(ChatSession.id == session_id)
+        .values(last_seq=ChatSession.last_seq + 1)
+        .returning(ChatSession.last_seq),
+        execution_options={'synchronize_session': False}
+    ).scalar_one()
 
 def save_message(session_id, sender_id, content):
     session = get_chat_session(session_id)
@@ -199,12 +707,49 @@ def save_message(session_id, sender_id, content):
         sender_id=sender_id,
         sender_type=sender_type,
         content=content,
-        created_at=datetime.now(timezone.utc)
+        created_at=datetime.now(timezone.utc),
+        seq=_reserve_message_seq(session_id)
     )
     db.session.add(message)
     db.session.commit()
     return message
 
+def queue_message(session_id, sender_id, content, on_saved=None):
+    """
+    Accepts a chat message for persistence: with the write-behind buffer
+    enabled it is only queued (written and numbered in the next batch),
+    otherwise it is saved right away like save_message. on_saved(seq) is
+    called once the message is stored.
+    """
+    if not message_buffer.enabled:
+        message = save_message(session_id, sender_id, content)
+        if on_saved:
+            on_saved(message.seq)
+        return
+    session = get_chat_session(session_id)
+    if not session:
+        raise ValueError("Sesión no encontrada")
+    message_buffer.add({
+        'chat_session_id': session_id,
+        'sender_id': sender_id,
+        'sender_type': 'user' if sender_id == session.user_id else 'creator',
+        'content': content,
+        'created_at': datetime.now(timezone.utc)
+    }, on_written=(lambda row: on_saved(row['seq'])) if on_saved else None)
+
+def get_messages_since(session_id, last_seq, limit=200):
+    """
+    Messages of a session with seq > last_seq, in order (a range scan on
+    ux_messages_session_seq). Returns (messages, complete); complete is False
+    when more than `limit` were missed and the client should reload history.
+    """
+    message_buffer.flush_for_read()
+    rows = Message.query.filter(
+        Message.chat_session_id == session_id,
+        Message.seq > last_seq
+    ).order_by(Message.seq.asc()).limit(limit + 1).all()
+    return rows[:limit], len(rows) <= limit
+
 def switch_session_to_human(session_id):
     session = get_chat_session(session_id)
     if not session:
@@ -213,96 +758,280 @@ def switch_session_to_human(session_id):
     db.session.commit()
     return session
 
-def ask_chatbot_session(session_id, current_node_id, query):
+def _select_knowledge_base(settings, retriever, compiled, current_node, query):
+    """
+    Picks the nodes sent to the model: the ancestor chain of the current node,
+    then the top-k BM25 hits for the query, until the chatbot's token budget
+    is spent. Returns node ids in prompt order.
+    """
+    candidates = [n.id for n in get_node_ancestors(current_node)]
+    seen = set(candidates)
+    for node_id in retriever.search(query, settings['retrieval_top_k']):
+        if node_id not in seen:
+            candidates.append(node_id)
+            seen.add(node_id)
+
+    selected, used = [], 0
+    for node_id in candidates:
+        entry = compiled.entries.get(node_id)
+        if entry is None or used + entry[1] > settings['context_token_budget']:
+            continue
+        selected.append(node_id)
+        used += entry[1]
+    return selected
+
+def _answer_cache_key(snapshot, node_id, query, messages, summary=None):
+    """
+    (chatbot_id, version, node_id, normalized query, history hash). The hash
+    covers the summary and the earlier turns only (the question itself, already
+    saved as the last message, is excluded) and is None when history is not
+    part of the key.
+    """
+    history_hash = None
+    if current_app.config['ANSWER_CACHE_HISTORY_AWARE']:
+        history_hash = hashlib.sha1(
+            repr((summary, [(m.sender_type, m.content) for m in _earlier_turns(messages, query)])).encode('utf-8')
+        ).hexdigest()
+    return (snapshot.id, snapshot.version, node_id, normalize_query(query), history_hash)
+
+def _earlier_turns(messages, query):
+    """
+    History without the question itself (already saved as the last message).
+    """
+    earlier = list(messages)
+    if earlier and earlier[-1].sender_type == 'user' and earlier[-1].content == query:
+        earlier.pop()
+    return earlier
+
+SUMMARY_INSTRUCTION = (
+    "Resume la conversación anterior (y el resumen previo, si existe) en un solo párrafo en español. "
+    "Conserva datos concretos del usuario, preguntas pendientes y acuerdos. Máximo 150 palabras."
+)
+
+def _unsummarized_messages(session):
+    query = Message.query.filter(Message.chat_session_id == session.id)
+    if session.summary_message_id:
+        query = query.filter(Message.id > session.summary_message_id)
+    return query
+
+def _fit_history(messages, summary, budget):
+    """
+    Keeps the newest messages that fit the token budget together with the
+    summary (the newest one is always kept). Input and output are oldest first.
+    """
+    remaining = budget - estimate_tokens(summary)
+    kept = []
+    for msg in reversed(messages):
+        cost = estimate_tokens(msg.content) + 2 # role label and newline
+        if kept and cost > remaining:
+            break
+        kept.append(msg)
+        remaining -= cost
+    kept.reverse()
+    return kept
+
+def _format_history(summary, messages):
+    history_str = ""
+    if summary:
+        history_str += f"Resumen de la conversación anterior: {summary}\n"
+    for msg in messages:
+        role = "Usuario" if msg.sender_type == 'user' else "IA"
+        history_str += f"{role}: {msg.content}\n"
+    return history_str
+
+def _pending_summary_tokens(session, window_start_id):
+    """
+    Estimated tokens of unsummarized messages older than the recent window.
+    """
+    chars = _unsummarized_messages(session).filter(Message.id < window_start_id).with_entities(
+        func.coalesce(func.sum(func.length(Message.content)), 0)
+    ).scalar()
+    return math.ceil(chars / CHARS_PER_TOKEN)
+
+def summarize_session(session_id):
+    """
+    Folds the unsummarized messages older than the recent window into
+    ChatSession.summary. Returns True when the summary was updated.
+    """
+    session = get_chat_session(session_id)
+    if not session:
+        return False
+    message_buffer.flush_for_read()
+    pending = _unsummarized_messages(session).order_by(Message.id.desc()).offset(
+        current_app.config['AI_HISTORY_MESSAGES']
+    ).all()
+    if not pending:
+        return False
+    pending.reverse()
+
+    context = ""
+    if session.summary:
+        context += f"Resumen previo:\n{session.summary}\n\n"
+    context += f"Conversación:\n{_format_history(None, pending)}"
+    started = time.perf_counter()
+    try:
+        summary = generate_response(context, SUMMARY_INSTRUCTION)
+    except AIProviderError:
+        return False
+    finally:
+        metrics.observe('ai.summary', time.perf_counter() - started)
+
+    session.summary = summary.strip()
+    session.summary_message_id = pending[-1].id
+    db.session.commit()
+    return True
+
+_summaries_in_progress = set()
+
+def schedule_session_summary(session_id):
+    """
+    Runs summarize_session in a background task, at most one per session.
+    """
+    from . import socketio
+    if session_id in _summaries_in_progress:
+        return False
+    _summaries_in_progress.add(session_id)
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                summarize_session(session_id)
+        except Exception as e:
+            print(f"SUMMARY ERROR: {e}")
+        finally:
+            _summaries_in_progress.discard(session_id)
+
+    socketio.start_background_task(run)
+    return True
+
+def _stream_to_room(socketio, room, stream_id, context, query):
+    """
+    Emits each provider chunk to the room as an `ai_chunk` event and returns
+    the full text. Time to first token is recorded as ai.ttft.
+    """
+    parts = []
+    started = time.perf_counter()
+    for index, delta in enumerate(stream_response(context, query)):
+        if index == 0:
+            metrics.observe('ai.ttft', time.perf_counter() - started)
+        parts.append(delta)
+        socketio.emit('ai_chunk', {'stream_id': stream_id, 'index': index, 'delta': delta}, room=room)
+        socketio.sleep(0) # Let the worker flush the chunk before waiting for the next one
+    return ''.join(parts)
+
+def ask_chatbot_session(session_id, current_node_id, query, stream=False):
     from . import socketio
     from flask_socketio import emit
     """
     Stateful AI chat.
     1. Fetches session and validates.
-    2. Fetches full tree and current node for context.
+    2. Fetches the chatbot snapshot and current node for context.
     3. Fetches conversation history.
     4. Constructs prompt.
-    5. Calls AI.
+    5. Calls AI (with stream=True, chunks are emitted as `ai_chunk` events and
+       the final `message` event carries the same stream_id).
     6. Saves AI response.
     """
+    timer = StageTimer('ask')
+
     # 1. Fetch Session
-    session = get_chat_session(session_id)
+    with timer.stage('session'):
+        session = get_chat_session(session_id)
     if not session:
         raise ValueError("Sesión no encontrada")
     
     # User message is already saved via socket event before calling this API
     # save_message(session_id, session.user_id, query)
     
-    # 3. Fetch Context (Tree + Node)
-    chatbot = get_chatbot(session.chatbot_id)
-    tree_json = get_chatbot_tree(session.chatbot_id)
-    current_node = db.session.get(Node, current_node_id)
+    # 3. Fetch Context (Snapshot + Node)
+    with timer.stage('context'):
+        chatbot = get_chatbot_snapshot(session.chatbot_id)
+        current_node = db.session.get(Node, current_node_id)
     
     if not current_node or current_node.chatbot_id != session.chatbot_id:
         raise ValueError("Nodo no encontrado o no pertenece a este chatbot")
         
-    # 4. Fetch History (Last 10 messages)
-    messages = Message.query.filter_by(chat_session_id=session_id).order_by(Message.created_at.desc()).limit(10).all()
-    messages.reverse() # Oldest first
-    
-    # 5. Construct Prompt
-    # System Instruction
-    system_prompt = (
-        f"Eres un asistente de soporte útil para el chatbot '{chatbot.title}'. "
-        "Tu objetivo es responder a las preguntas de los usuarios basándote ESTRICTAMENTE en la Base de Conocimiento proporcionada. "
-        "Si la respuesta no está en la Base de Conocimiento, di cortésmente que no lo sabes. "
-        "RESPONDE SIEMPRE EN ESPAÑOL."
-    )
-    
-    # Knowledge Base (Full Tree)
-    import json
-    kb_str = json.dumps(tree_json, indent=2)
-    
-    # Current Context
-    node_context = f"El usuario está viendo el nodo: '{current_node.label}'"
-    if current_node.content:
-        node_context += f" - Contenido: {current_node.content}"
-        
-    # History
-    history_str = ""
-    for msg in messages:
-        role = "Usuario" if msg.sender_type == 'user' else "IA"
-        history_str += f"{role}: {msg.content}\n"
-        
-    # Final Prompt Construction
-    full_prompt = (
-        f"{system_prompt}\n\n"
-        f"--- Base de Conocimiento ---\n{kb_str}\n\n"
-        f"--- Contexto Actual ---\n{node_context}\n\n"
-        f"--- Historial de Conversación ---\n{history_str}\n"
-        f"--- Pregunta del Usuario ---\n{query}"
-    )
-    
-    # 6. Call AI
-    complex_context = (
-        f"{system_prompt}\n\n"
-        f"--- Base de Conocimiento ---\n{kb_str}\n\n"
-        f"--- Contexto Actual ---\n{node_context}\n\n"
-        f"--- Historial de Conversación ---\n{history_str}"
-    )
+    # 4. Fetch History (rolling summary + last N unsummarized messages within the token budget)
+    with timer.stage('history'):
+        message_buffer.flush_for_read() # include messages still in the write-behind buffer
+        summary = session.summary
+        window = _unsummarized_messages(session).order_by(
+            Message.created_at.desc(), Message.id.desc()
+        ).limit(current_app.config['AI_HISTORY_MESSAGES']).all()
+        window.reverse() # Oldest first
+        messages = _fit_history(window, summary, current_app.config['AI_HISTORY_TOKEN_BUDGET'])
     
-    ai_response_text = generate_response(complex_context, query)
+    room = f"session_{session_id}"
+    stream_id = uuid.uuid4().hex if stream else None
+
+    settings = get_ai_settings(chatbot)
+    cache_key = _answer_cache_key(chatbot, current_node.id, query, messages, summary) if settings['answer_cache'] else None
+    ai_response_text = answer_cache.get(cache_key) if cache_key else None
+
+    if ai_response_text is None:
+        # 5. Construct Prompt: compiled prefix + retrieved entries + per-request context
+        with timer.stage('retrieval'):
+            retriever = get_chatbot_retriever(chatbot)
+            compiled = get_compiled_prompt(chatbot, retriever)
+            kb_node_ids = _select_knowledge_base(settings, retriever, compiled, current_node, query)
+
+        with timer.stage('prompt'):
+            node_context = f"El usuario está viendo el nodo: '{current_node.label}'"
+            content = chatbot.node_texts.get(current_node.id)
+            if content:
+                if compiled.kb_format == 'outline':
+                    content = ' '.join(content.split())
+                node_context += f" - Contenido: {content}"
+
+            history_str = _format_history(summary, messages)
+
+            complex_context = compiled.render(kb_node_ids, node_context, history_str)
+
+        # 6. Call AI. Without earlier turns the prompt depends only on
+        # (version, node, question), so identical concurrent questions share one call.
+        def call_provider():
+            if stream:
+                return _stream_to_room(socketio, room, stream_id, complex_context, query)
+            return generate_response(complex_context, query)
+
+        with timer.stage('generate'):
+            if current_app.config['AI_SINGLE_FLIGHT'] and not summary and not _earlier_turns(messages, query):
+                flight_key = (chatbot.id, chatbot.version, current_node.id, normalize_query(query))
+                ai_response_text = ai_flights.do(flight_key, call_provider)
+            else:
+                ai_response_text = call_provider()
+
+        if cache_key:
+            answer_cache.set(cache_key, ai_response_text)
     
     # 7. Save AI Response
-    ai_msg = Message(
-        chat_session_id=session_id,
-        sender_id=None,
-        sender_type='ai',
-        content=ai_response_text,
-        created_at=datetime.now(timezone.utc)
-    )
-    db.session.add(ai_msg)
-    db.session.commit()
+    with timer.stage('persist'):
+        ai_msg = Message(
+            chat_session_id=session_id,
+            sender_id=None,
+            sender_type='ai',
+            content=ai_response_text,
+            created_at=datetime.now(timezone.utc),
+            seq=_reserve_message_seq(session_id)
+        )
+        db.session.add(ai_msg)
+        db.session.commit()
     
     # 8. Emit to Room
-    room = f"session_{session_id}"
-    socketio.emit('message', {'user_id': None, 'content': ai_response_text}, room=room)
-    
+    with timer.stage('emit'):
+        payload = {'user_id': None, 'content': ai_response_text, 'seq': ai_msg.seq}
+        if stream_id:
+            payload['stream_id'] = stream_id
+        socketio.emit('message', payload, room=room)
+        notify_creator_inbox(session, 'message', seq=ai_msg.seq)
+
+    # 9. Fold older turns into the summary once they outgrow the threshold
+    if len(window) >= current_app.config['AI_HISTORY_MESSAGES'] and \
+            _pending_summary_tokens(session, window[0].id) >= current_app.config['AI_SUMMARY_TRIGGER_TOKENS']:
+        schedule_session_summary(session_id)
+
+    timer.finish()
     return ai_response_text
 
 def get_creator_sessions(creator_id):
@@ -316,8 +1045,114 @@ def get_creator_sessions(creator_id):
     ).all()
     return sessions
 
+def get_creator_inbox(creator_id):
+    """
+    Open human-support sessions of the creator's chatbots, with the chatbot
+    title, in one query (initial load of the inbox; deltas arrive by socket).
+    """
+    rows = db.session.execute(
+        select(ChatSession.id, Chatbot.title, ChatSession.user_id, ChatSession.created_at, ChatSession.last_seq)
+        .join(Chatbot, Chatbot.id == ChatSession.chatbot_id)
+        .where(
+            Chatbot.creator_id == creator_id,
+            ChatSession.status != 'resolved',
+            ChatSession.type == 'human_support'
+        )
+        .order_by(ChatSession.created_at, ChatSession.id)
+    ).all()
+    return [_inbox_entry(*row) for row in rows]
+
+def _inbox_entry(session_id, chatbot_title, user_id, created_at, last_seq):
+    return {
+        'id': session_id,
+        'chatbot_title': chatbot_title,
+        'user_id': user_id,
+        'created_at': created_at.isoformat(),
+        'last_seq': last_seq
+    }
+
+def notify_creator_inbox(session, change, seq=None):
+    """
+    Pushes a compact delta to the room `creator_<id>` of the chatbot's
+    creator: 'upsert' (the session asked for a human), 'remove' (back to AI
+    or resolved) or 'message' (new message seq in a human-support session).
+    """
+    from . import socketio
+    chatbot = get_chatbot_snapshot(session.chatbot_id)
+    if chatbot is None:
+        return
+    room = f"creator_{chatbot.creator_id}"
+    if change == 'upsert':
+        entry = _inbox_entry(session.id, chatbot.title, session.user_id, session.created_at, session.last_seq)
+        socketio.emit('inbox_upsert', entry, room=room)
+    elif change == 'remove':
+        socketio.emit('inbox_remove', {'id': session.id}, room=room)
+    elif change == 'message' and session.type == 'human_support':
+        socketio.emit('inbox_message', {'id': session.id, 'last_seq': seq}, room=room)
+
+def get_session_messages_etag(session_id, limit=None, before=None, after=None):
+    """
+    Messages are append-only and get their seq in the transaction that
+    inserts them, so the highest stored seq (one lookup on
+    ux_messages_session_seq) identifies the history; the page parameters are
+    part of the tag. Rows still pending in a buffer do not change it.
+    """
+    message_buffer.flush_for_read()
+    last_seq = db.session.scalar(select(func.max(Message.seq)).where(Message.chat_session_id == session_id))
+    return f"messages-{session_id}-{last_seq or 0}-{limit}-{before}-{after}"
+
 def get_session_messages(session_id):
-    return Message.query.filter_by(chat_session_id=session_id).order_by(Message.created_at.asc()).all()
+    message_buffer.flush_for_read()
+    return Message.query.filter_by(chat_session_id=session_id).order_by(Message.created_at.asc(), Message.id.asc()).all()
+
+def _encode_message_cursor(message):
+    return f"{message.created_at.replace(tzinfo=None).isoformat()}_{message.id}"
+
+def _decode_message_cursor(cursor):
+    try:
+        created_at, message_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at).replace(tzinfo=None), int(message_id)
+    except (AttributeError, ValueError):
+        raise ValueError('Cursor inválido')
+
+def get_session_message_page(session_id, limit=50, before=None, after=None):
+    """
+    One page of a session's history in chronological order, by keyset over
+    (created_at, id): the latest `limit` messages, the ones right before the
+    `before` cursor, or the ones right after the `after` cursor.
+    prev_cursor / next_cursor are None when there is nothing older / newer.
+    """
+    if before and after:
+        raise ValueError('Usa before o after, no ambos')
+    message_buffer.flush_for_read()
+    key = (Message.created_at, Message.id)
+    query = Message.query.filter(Message.chat_session_id == session_id)
+
+    if after:
+        created_at, message_id = _decode_message_cursor(after)
+        query = query.filter(or_(
+            Message.created_at > created_at,
+            and_(Message.created_at == created_at, Message.id > message_id)
+        ))
+        rows = query.order_by(*[c.asc() for c in key]).limit(limit + 1).all()
+        messages = rows[:limit]
+        has_older, has_newer = True, len(rows) > limit
+    else:
+        if before:
+            created_at, message_id = _decode_message_cursor(before)
+            query = query.filter(or_(
+                Message.created_at < created_at,
+                and_(Message.created_at == created_at, Message.id < message_id)
+            ))
+        rows = query.order_by(*[c.desc() for c in key]).limit(limit + 1).all()
+        messages = rows[:limit][::-1]
+        has_older, has_newer = len(rows) > limit, bool(before)
+
+    return {
+        'messages': messages,
+        'prev_cursor': _encode_message_cursor(messages[0]) if messages and has_older else None,
+        'next_cursor': _encode_message_cursor(messages[-1]) if messages and has_newer else None
+    }
 
 def switch_session_to_human(session_id):
     """
@@ -357,6 +1192,8 @@ def resolve_chat_session(session_id, user_id):
 
     session.status = 'resolved'
     db.session.commit()
+    invalidate_session_access(session_id=session_id)
+    notify_creator_inbox(session, 'remove')
     return session
 
 from flask_mail import Message as MailMessage
@@ -1,21 +1,87 @@
+import math
 import os
+from abc import ABC, abstractmethod
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 try:
     import google.generativeai as genai
 except ImportError:
     genai = None
+from .tokens import estimate_tokens
+from .resilience import CircuitBreaker
 
-def generate_response(context: str, query: str) -> str:
+# Provider options, set by create_app through configure_client
+_settings = {
+    'provider': '', 'model': 'gemini-flash-latest', 'timeout': 30, 'transport': 'rest', 'fake': {},
+    'deadline': 45, 'retries': 2, 'backoff': 0.5, 'hedge_after': 0
+}
+_client = None # ((api_key, model, transport), GenerativeModel)
+_client_lock = threading.Lock()
+_provider = None
+
+class AIProviderError(RuntimeError):
     """
-    Generates a response from the AI based on the provided context and query.
-    
-    Args:
-        context (str): The information from the current node and its children.
-        query (str): The user's question.
-        
-    Returns:
-        str: The AI's response.
+    Structured provider failure. `reason` is 'circuit_open', 'timeout' or
+    'provider_error'; `retry_after` is a hint in seconds for clients.
     """
-    
+
+    def __init__(self, reason, message, retry_after=None):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        return {'reason': self.reason, 'retry_after': self.retry_after}
+
+def configure_client(model=None, timeout=None, transport=None, provider=None, fake_options=None,
+                     deadline=None, retries=None, backoff=None, hedge_after=None):
+    """
+    Sets provider options and drops the current client so the next call
+    builds one with them.
+    """
+    global _client, _provider
+    with _client_lock:
+        for name, value in (('deadline', deadline), ('retries', retries), ('backoff', backoff), ('hedge_after', hedge_after)):
+            if value is not None:
+                _settings[name] = value
+        if model:
+            _settings['model'] = model
+        if timeout:
+            _settings['timeout'] = timeout
+        if transport:
+            _settings['transport'] = transport
+        if provider is not None:
+            _settings['provider'] = provider
+        if fake_options is not None:
+            _settings['fake'] = dict(fake_options)
+        _client = None
+        _provider = None
+        usage.reset()
+    breaker.reset()
+
+def get_model():
+    """
+    Returns the process-wide GenerativeModel, creating it on first use.
+    genai.configure() runs once per API key, and the REST transport keeps its
+    HTTP connections pooled (unlike gRPC it is safe under eventlet green threads).
+    """
+    global _client
+    key = (os.getenv('GEMINI_API_KEY'), _settings['model'], _settings['transport'])
+    client = _client
+    if client is not None and client[0] == key:
+        return client[1]
+    with _client_lock:
+        if _client is None or _client[0] != key:
+            genai.configure(api_key=key[0], transport=key[2])
+            _client = (key, genai.GenerativeModel(key[1]))
+        return _client[1]
+
+def _request_options(timeout=None):
+    return {'timeout': min(timeout, _settings['timeout']) if timeout else _settings['timeout']}
+
+def _build_prompt(context: str, query: str) -> str:
     # Construct the system prompt
     system_prompt = (
         "You are a helpful assistant for a chatbot platform. "
@@ -23,19 +89,329 @@ def generate_response(context: str, query: str) -> str:
         "If the answer is not in the context, politely say you don't know."
     )
     
-    full_prompt = f"{system_prompt}\n\nContext:\n{context}\n\nUser Question:\n{query}"
-    
-    api_key = os.getenv('GEMINI_API_KEY')
-    
-    if api_key:
+    return f"{system_prompt}\n\nContext:\n{context}\n\nUser Question:\n{query}"
+
+class AIProvider(ABC):
+    """
+    Interface of the answer providers. generate() returns the whole answer,
+    stream() yields it in chunks; both raise on provider errors.
+    """
+    name = 'base'
+
+    @abstractmethod
+    def generate(self, context: str, query: str, timeout=None) -> str:
+        pass
+
+    def stream(self, context: str, query: str, timeout=None):
+        yield self.generate(context, query, timeout)
+
+    def count_tokens(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def warm_up(self) -> bool:
+        return False
+
+class GeminiProvider(AIProvider):
+    name = 'gemini'
+
+    def generate(self, context, query, timeout=None):
+        response = get_model().generate_content(_build_prompt(context, query), request_options=_request_options(timeout))
+        return response.text
+
+    def stream(self, context, query, timeout=None):
+        for chunk in get_model().generate_content(_build_prompt(context, query), stream=True, request_options=_request_options(timeout)):
+            if chunk.text:
+                yield chunk.text
+
+    def warm_up(self):
+        # A cheap token count opens the connection before the first question
+        get_model().count_tokens("ping", request_options=_request_options())
+        return True
+
+class MockProvider(AIProvider):
+    """
+    Instant canned answer, used when no API key is configured.
+    """
+    name = 'mock'
+
+    def generate(self, context, query, timeout=None):
+        return f"[MOCK AI RESPONSE] (API Key missing) based on context: {context[:200]}..."
+
+    def stream(self, context, query, timeout=None):
+        # One word per chunk
+        for word in self.generate(context, query).split(' '):
+            yield word + ' '
+
+class FakeProviderError(RuntimeError):
+    pass
+
+FAKE_WORDS = (
+    "según", "el", "contenido", "del", "chatbot", "la", "respuesta", "es", "que", "puedes",
+    "consultar", "esta", "sección", "para", "más", "detalles", "sobre", "el", "tema"
+)
+
+class FakeProvider(AIProvider):
+    """
+    Offline provider for load tests. The time to first token follows a
+    log-normal distribution (median latency_ms, spread sigma), the answer has
+    `tokens` words emitted at tokens_per_second, and error_rate of the calls
+    fail after the first-token delay. A first-token delay longer than the
+    call's timeout raises TimeoutError once the timeout has passed. Sleeps are
+    cooperative under eventlet.
+    """
+    name = 'fake'
+
+    def __init__(self, latency_ms=800, sigma=0.5, tokens=120, tokens_per_second=60, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self):
+        with self._lock:
+            ttft = self.latency_ms / 1000 * math.exp(self._random.gauss(0, self.sigma)) if self.latency_ms else 0
+            failed = self._random.random() < self.error_rate
+            words = [self._random.choice(FAKE_WORDS) for _ in range(max(self.tokens - 1, 0))]
+        return ttft, failed, words
+
+    def _wait_first_token(self, ttft, timeout):
+        if timeout is not None and ttft > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Sin respuesta en {timeout:.1f}s")
+        time.sleep(ttft)
+
+    def _token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0
+
+    def stream(self, context, query, timeout=None):
+        ttft, failed, words = self._draw()
+        self._wait_first_token(ttft, timeout)
+        if failed:
+            raise FakeProviderError("Fake provider error")
+        delay = self._token_delay()
+        yield "[FAKE]"
+        for word in words:
+            if delay:
+                time.sleep(delay)
+            yield " " + word
+
+    def generate(self, context, query, timeout=None):
+        ttft, failed, words = self._draw()
+        self._wait_first_token(ttft, timeout)
+        if failed:
+            raise FakeProviderError("Fake provider error")
+        time.sleep(self._token_delay() * len(words))
+        return " ".join(("[FAKE]",) + tuple(words))
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+class ProviderUsage:
+    """
+    Call, error and token counters across providers (exported as ai_provider).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedges = 0
+        self.timeouts = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record(self, prompt_tokens, completion_tokens=0, error=False):
+        with self._lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                'provider': _settings['provider'] or 'auto',
+                'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'hedges': self.hedges,
+                'timeouts': self.timeouts,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens
+            }
+
+usage = ProviderUsage()
+breaker = CircuitBreaker()
+# Provider calls run here so they can be bounded by a deadline and hedged
+# (green threads once eventlet has monkey patched threading)
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='ai-provider')
+
+def get_provider() -> AIProvider:
+    """
+    Returns the provider selected by AI_PROVIDER (gemini, mock or fake).
+    When unset, Gemini is used if GEMINI_API_KEY is defined and mock otherwise.
+    """
+    global _provider
+    name = _settings['provider']
+    if not name:
+        return GeminiProvider() if os.getenv('GEMINI_API_KEY') else MockProvider()
+    if _provider is None or _provider.name != name:
+        if name == 'gemini':
+            _provider = GeminiProvider()
+        elif name == 'mock':
+            _provider = MockProvider()
+        elif name == 'fake':
+            _provider = FakeProvider(**_settings['fake'])
+        else:
+            raise ValueError(f"Proveedor de IA desconocido: {name}")
+    return _provider
+
+def warm_up():
+    """
+    Builds the client and opens its connection so the first user question
+    does not pay the setup cost.
+    """
+    try:
+        return get_provider().warm_up()
+    except Exception as e:
+        print(f"Error warming up AI provider: {e}")
+        return False
+
+def _backoff(attempt, remaining):
+    # Exponential backoff with full jitter, never past the deadline
+    delay = random.uniform(0, _settings['backoff'] * (2 ** attempt))
+    time.sleep(max(0, min(delay, remaining)))
+
+def _attempt(call, timeout):
+    """
+    One provider call, call(timeout), bounded by `timeout`. With hedge_after
+    set, a second identical call is started if the first is still running
+    after that many seconds, and whichever succeeds first wins (the other is
+    abandoned).
+    """
+    hedge_after = _settings['hedge_after']
+    futures = [_executor.submit(call, timeout)]
+    deadline = time.monotonic() + timeout
+    error = None
+    hedged = False
+    while futures:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        can_hedge = hedge_after and not hedged
+        done, _ = wait(futures, timeout=min(remaining, hedge_after) if can_hedge else remaining,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            futures.remove(future)
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        if not done and can_hedge:
+            futures.append(_executor.submit(call, timeout))
+            hedged = True
+            usage.count('hedges')
+    if futures:
+        usage.count('timeouts')
+        raise TimeoutError(f"Sin respuesta en {timeout:.1f}s")
+    raise error
+
+def _call_with_retries(call):
+    """
+    Runs call(timeout) through the circuit breaker with bounded retries until
+    the overall deadline. Raises AIProviderError when it gives up.
+    """
+    if not breaker.allow():
+        raise AIProviderError('circuit_open', "El asistente no está disponible temporalmente",
+                              retry_after=math.ceil(breaker.retry_after()) or 1)
+    deadline = time.monotonic() + _settings['deadline']
+    error = None
+    for attempt in range(_settings['retries'] + 1):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if attempt:
+            usage.count('retries')
         try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-flash-latest')
-            response = model.generate_content(full_prompt)
-            return response.text
+            result = call(min(remaining, _settings['timeout']))
+            breaker.record_success()
+            return result
         except Exception as e:
-            print(f"Error calling Gemini API: {e}")
-            return f"Error generating response: {str(e)}"
+            print(f"Error calling AI provider (attempt {attempt + 1}): {e}")
+            breaker.record_failure()
+            error = e
+            if attempt == _settings['retries'] or breaker.state == 'open':
+                break
+            _backoff(attempt, deadline - time.monotonic())
+    if isinstance(error, TimeoutError) or error is None:
+        raise AIProviderError('timeout', "El asistente tardó demasiado en responder", retry_after=5)
+    raise AIProviderError('provider_error', "El asistente no pudo generar una respuesta", retry_after=5)
+
+def generate_response(context: str, query: str) -> str:
+    """
+    Generates a response from the AI based on the provided context and query.
+    
+    Args:
+        context (str): The information from the current node and its children.
+        query (str): The user's question.
         
-    # Mock Response for development/testing (fallback)
-    return f"[MOCK AI RESPONSE] (API Key missing) based on context: {context[:200]}..."
+    Returns:
+        str: The AI's response.
+
+    Raises:
+        AIProviderError: the breaker is open, or every attempt failed or timed out.
+    """
+    provider = get_provider()
+    prompt_tokens = provider.count_tokens(_build_prompt(context, query))
+    try:
+        text = _call_with_retries(
+            lambda timeout: _attempt(lambda t: provider.generate(context, query, t), timeout)
+        )
+    except AIProviderError:
+        usage.record(prompt_tokens, error=True)
+        raise
+    usage.record(prompt_tokens, provider.count_tokens(text))
+    return text
+
+def stream_response(context: str, query: str):
+    """
+    Same as generate_response, but yields the answer in text chunks as the
+    provider produces them. Opening the stream and waiting for the first
+    chunk is bounded and hedged like a generate call, and failures up to
+    there are retried; later chunks are not bounded by the deadline, and
+    failures after the first chunk raise AIProviderError.
+    """
+    provider = get_provider()
+    prompt_tokens = provider.count_tokens(_build_prompt(context, query))
+
+    def first_chunk(timeout):
+        chunks = provider.stream(context, query, timeout)
+        return chunks, next(chunks, '')
+
+    try:
+        chunks, first = _call_with_retries(lambda timeout: _attempt(first_chunk, timeout))
+    except AIProviderError:
+        usage.record(prompt_tokens, error=True)
+        raise
+    parts = [first]
+    yield first
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    except Exception as e:
+        print(f"Error calling AI provider ({provider.name}) mid-stream: {e}")
+        breaker.record_failure()
+        usage.record(prompt_tokens, error=True)
+        raise AIProviderError('provider_error', "El asistente no pudo generar una respuesta", retry_after=5)
+    usage.record(prompt_tokens, provider.count_tokens(''.join(parts)))
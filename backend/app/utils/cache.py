@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Thread-safe bounded LRU cache with hit/miss/eviction counters and an
+    optional time-to-live (seconds) per entry.
+    Values are treated as immutable; callers must not mutate what they get back.
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        """
+        Resizes the cache and drops all entries and counters (used by create_app).
+        """
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl or None
+            self._data.clear()
+            self._reset_counters()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                value, expires_at = self._data[key]
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def pop_matching(self, predicate):
+        """
+        Removes every entry whose key satisfies predicate(key).
+        """
+        with self._lock:
+            stale = [key for key in self._data if predicate(key)]
+            for key in stale:
+                del self._data[key]
+            self.invalidations += len(stale)
+
+    def pop_where(self, predicate):
+        """
+        Removes every entry for which predicate(key, value) is true.
+        """
+        with self._lock:
+            stale = [key for key, (value, _) in self._data.items() if predicate(key, value)]
+            for key in stale:
+                del self._data[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+# Per-chatbot snapshots keyed by (chatbot_id, version)
+chatbot_cache = LRUCache(maxsize=256)
+
+# BM25 retrievers keyed by (chatbot_id, version)
+retrieval_cache = LRUCache(maxsize=64)
+
+# Compiled prompt prefixes keyed by (chatbot_id, version, kb_format)
+prompt_cache = LRUCache(maxsize=64)
+
+# AI answers keyed by (chatbot_id, version, node_id, normalized query, history hash)
+answer_cache = LRUCache(maxsize=1024, ttl=600)
+
+# Session participants keyed by session_id -> (chatbot_id, starter user_id, creator_id)
+session_access_cache = LRUCache(maxsize=4096, ttl=300)
@@ -0,0 +1,141 @@
+import threading
+import time
+import uuid
+from .cache import LRUCache
+from .metrics import metrics
+from .ai_client import AIProviderError
+
+class QueueFullError(RuntimeError):
+    """
+    Raised by AIJobQueue.submit when the pending-job limit is reached.
+    """
+
+class AIJobQueue:
+    """
+    Bounded job queue drained by a fixed pool of background workers.
+    The pool size caps how many jobs run at once and `maxsize` caps how many
+    may wait; submit() fails fast instead of piling requests up.
+    Workers are started through the Socket.IO async backend (green threads
+    under eventlet) on the first submit, and each job runs inside an app context.
+    Job records live in-process, so status is only visible to the worker that
+    accepted the job (the Procfile runs a single one).
+    """
+
+    def __init__(self, workers=2, maxsize=100, result_ttl=600):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.jobs = LRUCache(maxsize=1024, ttl=result_ttl)
+        self._app = None
+        self._socketio = None
+        self._queue = None
+        self._started = 0
+        self._pending = 0
+        self._running = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def configure(self, app, socketio, workers=None, maxsize=None, result_ttl=None):
+        """
+        Binds the queue to an app (used by create_app). Workers of a previous
+        configuration are told to stop once their current job ends.
+        """
+        with self._lock:
+            if self._queue is not None:
+                for _ in range(self._started):
+                    self._queue.put(None)
+            if workers is not None:
+                self.workers = workers
+            if maxsize is not None:
+                self.maxsize = maxsize
+            self._app = app
+            self._socketio = socketio
+            self._queue = None
+            self._started = 0
+            self._pending = 0
+            self._running = 0
+            self._rejected = 0
+        self.jobs.configure(maxsize=max(1024, self.maxsize * 4), ttl=result_ttl)
+
+    @property
+    def enabled(self):
+        return self._app is not None and self.workers > 0
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = self._socketio.server.eio.create_queue()
+        while self._started < self.workers:
+            self._socketio.start_background_task(self._worker, self._queue)
+            self._started += 1
+
+    def submit(self, func, *args, owner_id=None, **kwargs):
+        """
+        Enqueues func(*args, **kwargs) and returns the job record.
+        Raises QueueFullError when `maxsize` jobs are already waiting.
+        """
+        with self._lock:
+            if self._pending >= self.maxsize:
+                self._rejected += 1
+                raise QueueFullError("Cola de IA llena")
+            self._ensure_workers()
+            self._pending += 1
+            job = {
+                'id': uuid.uuid4().hex,
+                'status': 'queued',
+                'owner_id': owner_id,
+                'result': None,
+                'error': None,
+                'created_at': time.time()
+            }
+            self.jobs.set(job['id'], job)
+            self._queue.put((job['id'], func, args, kwargs))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _update(self, job_id, **changes):
+        job = self.jobs.get(job_id) or {'id': job_id}
+        self.jobs.set(job_id, {**job, **changes})
+
+    def _worker(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            self._run(*item)
+
+    def _run(self, job_id, func, args, kwargs):
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        job = self.jobs.get(job_id) or {}
+        started = time.time()
+        metrics.observe('ai_jobs.wait', started - job.get('created_at', started))
+        self._update(job_id, status='running')
+        try:
+            with self._app.app_context():
+                result = func(*args, **kwargs)
+            self._update(job_id, status='done', result=result)
+        except AIProviderError as e:
+            self._update(job_id, status='failed', error=str(e), failure=e.to_dict())
+        except ValueError as e:
+            self._update(job_id, status='failed', error=str(e))
+        except Exception as e:
+            print(f"AI JOB ERROR: {e}")
+            self._update(job_id, status='failed', error='Error interno del servidor')
+        finally:
+            metrics.observe('ai_jobs.run', time.time() - started)
+            with self._lock:
+                self._running -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'maxsize': self.maxsize,
+                'pending': self._pending,
+                'running': self._running,
+                'rejected': self._rejected
+            }
+
+ai_jobs = AIJobQueue()
@@ -0,0 +1,244 @@
+import atexit
+import threading
+import time
+from collections import Counter, deque
+from .metrics import metrics
+
+class MessageBuffer:
+    """
+    Write-behind buffer for chat messages. add() only queues the row; a
+    background task inserts queued rows in multi-row batches every
+    `interval` seconds or as soon as `batch_size` rows are waiting.
+
+    Rows are inserted in the order they were added (one flush at a time).
+    With a sessions table configured, each batch also numbers its rows:
+    one `last_seq = last_seq + n` per session in the batch's transaction, so
+    queuing a message never commits on its own. A row's callback runs once
+    it is written, with the row (and its seq).
+    When a batch fails its rows are retried one by one: a row the database
+    rejects (IntegrityError / DataError) is requeued and moved to
+    `dead_letters` after `max_attempts`, so it cannot block the rows behind
+    it; any other error (e.g. the database is down) puts the rows back at the
+    head of the queue. Pending rows are flushed on worker shutdown and at
+    interpreter exit, and readers call flush_for_read() before reading history.
+    """
+
+    def __init__(self, batch_size=100, interval=0.05, max_pending=10000, max_attempts=3):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._rows = deque() # [row, failed attempts, on_written]
+        self.dead_letters = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._app = None
+        self._socketio = None
+        self._table = None
+        self._sessions = None
+        self._wake = None
+        self._running = False
+        self._reset_counters()
+        atexit.register(self.close)
+
+    def _reset_counters(self):
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.max_depth = 0
+
+    def configure(self, app, socketio, table, enabled=False, batch_size=None, interval=None, max_pending=None,
+                  max_attempts=None, sessions_table=None):
+        """
+        Binds the buffer to an app and table (used by create_app); rows are
+        numbered through sessions_table.last_seq when it is given. Rows still
+        pending from a previous configuration are flushed first.
+        """
+        if self._app is not None:
+            self.flush_all()
+        self._running = False
+        if self._wake is not None:
+            self._wake.set() # let the old flusher exit
+        self._app = app if enabled else None
+        self._socketio = socketio
+        self._table = table
+        self._sessions = sessions_table
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if interval is not None:
+            self.interval = interval
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+        self._wake = None
+        self._reset_counters()
+
+    @property
+    def enabled(self):
+        return self._app is not None
+
+    def _ensure_flusher(self):
+        if not self._running:
+            self._running = True
+            self._wake = self._socketio.server.eio.create_event()
+            self._socketio.start_background_task(self._flusher, self._wake)
+
+    def add(self, row, on_written=None):
+        """
+        Queues one message row (a dict of Message columns); on_written(row)
+        is called after the row is stored.
+        """
+        with self._lock:
+            self._rows.append([row, 0, on_written])
+            depth = len(self._rows)
+            self.max_depth = max(self.max_depth, depth)
+            self._ensure_flusher()
+        if depth >= self.max_pending:
+            # Backpressure: the writer has fallen behind, persist inline
+            self.flush_all()
+        elif depth >= self.batch_size:
+            self._wake.set()
+
+    def _flusher(self, wake):
+        while self._running and wake is self._wake:
+            wake.wait(self.interval)
+            wake.clear()
+            try:
+                self.flush_all()
+            except Exception as e:
+                print(f"MESSAGE BUFFER ERROR: {e}")
+
+    def _number(self, conn, rows):
+        """
+        Sets each row's seq from one UPDATE ... RETURNING per session (in id
+        order, so concurrent flushers lock sessions in the same order).
+        """
+        from sqlalchemy import update
+        sessions = self._sessions
+        next_seq = {}
+        for session_id, count in sorted(Counter(row['chat_session_id'] for row in rows).items()):
+            last_seq = conn.execute(
+                update(sessions)
+                .where(sessions.c.id == session_id)
+                .values(last_seq=sessions.c.last_seq + count)
+                .returning(sessions.c.last_seq)
+            ).scalar()
+            next_seq[session_id] = None if last_seq is None else last_seq - count + 1
+        for row in rows:
+            seq = next_seq[row['chat_session_id']]
+            row['seq'] = seq
+            if seq is not None:
+                next_seq[row['chat_session_id']] = seq + 1
+
+    def _insert(self, rows):
+        from ..models import db
+        with self._app.app_context():
+            with db.engine.begin() as conn:
+                if self._sessions is not None:
+                    self._number(conn, rows)
+                conn.execute(self._table.insert(), rows)
+
+    def _notify(self, entries):
+        callbacks = [(row, on_written) for row, _, on_written in entries if on_written is not None]
+        if not callbacks:
+            return
+        with self._app.app_context():
+            for row, on_written in callbacks:
+                try:
+                    on_written(row)
+                except Exception as e:
+                    print(f"MESSAGE BUFFER ERROR in callback: {e}")
+
+    def flush(self):
+        """
+        Inserts up to batch_size pending rows in one transaction, falling
+        back to row-by-row inserts when the batch fails. Returns the number of
+        rows written. Errors other than rejected rows requeue what is left and
+        are re-raised.
+        """
+        if not self._rows or self._app is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                self._insert([entry[0] for entry in batch])
+                written = batch
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                print(f"MESSAGE BUFFER ERROR: batch failed, retrying rows one by one: {e}")
+                written = self._flush_rows(batch)
+            metrics.observe('message_buffer.flush', time.perf_counter() - started)
+            with self._lock:
+                self.flushed += len(written)
+                self.batches += 1
+        self._notify(written)
+        return len(written)
+
+    def _flush_rows(self, batch):
+        from sqlalchemy.exc import IntegrityError, DataError
+        written = []
+        retry = []
+        for i, entry in enumerate(batch):
+            try:
+                self._insert([entry[0]])
+                written.append(entry)
+            except (IntegrityError, DataError) as e:
+                entry[1] += 1
+                if entry[1] >= self.max_attempts:
+                    with self._lock:
+                        self.dead_letters.append(entry[0])
+                        self.dead_lettered += 1
+                    print(f"MESSAGE BUFFER ERROR: row dead-lettered after {entry[1]} attempts: {e}")
+                else:
+                    retry.append(entry)
+            except Exception:
+                with self._lock:
+                    self._rows.extendleft(reversed(retry + batch[i:]))
+                self._notify(written)
+                raise
+        with self._lock:
+            self._rows.extendleft(reversed(retry))
+        return written
+
+    def flush_all(self):
+        total = 0
+        while self._rows and self._app is not None:
+            total += self.flush()
+        return total
+
+    def flush_for_read(self):
+        """
+        flush_all() for readers: a failing flush is logged, not raised, so
+        history stays readable (without the rows that are still pending).
+        """
+        try:
+            self.flush_all()
+        except Exception as e:
+            print(f"MESSAGE BUFFER ERROR on read: {e}")
+
+    def close(self):
+        try:
+            self.flush_all()
+        except Exception as e:
+            print(f"MESSAGE BUFFER ERROR on shutdown: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'depth': len(self._rows),
+                'max_depth': self.max_depth,
+                'flushed': self.flushed,
+                'batches': self.batches,
+                'failures': self.failures,
+                'dead_lettered': self.dead_lettered
+            }
+
+message_buffer = MessageBuffer()
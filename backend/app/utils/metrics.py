@@ -0,0 +1,75 @@
+import threading
+import time
+from contextlib import contextmanager
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry. Components register a collector
+    callable, and timings are aggregated per name; /api/metrics returns both.
+    """
+
+    def __init__(self):
+        self._collectors = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, collector):
+        with self._lock:
+            self._collectors[name] = collector
+
+    def observe(self, name, seconds):
+        with self._lock:
+            stat = self._timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stat['count'] += 1
+            stat['total'] += seconds
+            stat['max'] = max(stat['max'], seconds)
+
+    def timings(self):
+        with self._lock:
+            return {
+                name: {
+                    'count': stat['count'],
+                    'avg_ms': round(stat['total'] / stat['count'] * 1000, 3),
+                    'max_ms': round(stat['max'] * 1000, 3)
+                }
+                for name, stat in self._timings.items()
+            }
+
+    def reset_timings(self):
+        with self._lock:
+            self._timings.clear()
+
+    def collect(self):
+        with self._lock:
+            collectors = dict(self._collectors)
+        result = {name: collector() for name, collector in collectors.items()}
+        result['timings'] = self.timings()
+        return result
+
+metrics = MetricsRegistry()
+
+class StageTimer:
+    """
+    Times the consecutive stages of one operation and records each one as
+    "<operation>.<stage>" (plus "<operation>.total") in the registry.
+    """
+
+    def __init__(self, operation, registry=None):
+        self.operation = operation
+        self.registry = registry or metrics
+        self.stages = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self):
+        self.stages['total'] = time.perf_counter() - self._started
+        for name, seconds in self.stages.items():
+            self.registry.observe(f"{self.operation}.{name}", seconds)
+        return self.stages
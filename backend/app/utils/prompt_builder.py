@@ -0,0 +1,86 @@
+import json
+from dataclasses import dataclass
+
+from .tokens import estimate_tokens
+
+# 'json': one indented JSON object per node (id, path, label, plain-text content).
+# 'outline': indented "- label: plain text" lines under their ancestors, no ids.
+KB_FORMATS = ('json', 'outline')
+
+SYSTEM_PROMPT_TEMPLATE = (
+    "Eres un asistente de soporte útil para el chatbot '{title}'. "
+    "Tu objetivo es responder a las preguntas de los usuarios basándote ESTRICTAMENTE en la Base de Conocimiento proporcionada. "
+    "Si la respuesta no está en la Base de Conocimiento, di cortésmente que no lo sabes. "
+    "RESPONDE SIEMPRE EN ESPAÑOL."
+)
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """
+    Static part of a chatbot's prompt for one version: the system instructions
+    and every node already rendered as a knowledge-base entry with its token
+    cost. Per request only the selection, node context and history are added.
+    """
+    prefix: str
+    entries: dict  # node_id -> (rendered entry, estimated tokens)
+    kb_format: str = 'json'
+    outline: dict = None  # node_id -> (preorder position, parent_id, heading line); outline only
+
+    def render_kb(self, kb_node_ids):
+        if self.kb_format != 'outline':
+            return "[\n" + ",\n".join(self.entries[i][0] for i in kb_node_ids) + "\n]"
+        # Selected nodes with their content, under the headings of their ancestors
+        selected = set(kb_node_ids)
+        shown = set()
+        for node_id in kb_node_ids:
+            while node_id is not None and node_id not in shown:
+                shown.add(node_id)
+                node_id = self.outline[node_id][1]
+        return "\n".join(
+            self.entries[i][0] if i in selected else self.outline[i][2]
+            for i in sorted(shown, key=lambda i: self.outline[i][0])
+        )
+
+    def render(self, kb_node_ids, node_context, history_str):
+        kb_str = self.render_kb(kb_node_ids)
+        return (
+            f"{self.prefix}"
+            f"--- Base de Conocimiento ---\n{kb_str}\n\n"
+            f"--- Contexto Actual ---\n{node_context}\n\n"
+            f"--- Historial de Conversación ---\n{history_str}"
+        )
+
+def compile_prompt(snapshot, retriever, kb_format='json') -> CompiledPrompt:
+    if kb_format == 'outline':
+        return _compile_outline(snapshot, retriever)
+    entries = {}
+    for node_id, node in retriever.nodes.items():
+        text = json.dumps({
+            'id': node_id,
+            'ruta': ' > '.join(retriever.path_labels(node_id)),
+            'label': node['label'],
+            'content': retriever.texts.get(node_id, '')
+        }, indent=2, ensure_ascii=False)
+        entries[node_id] = (text, estimate_tokens(text))
+    return CompiledPrompt(
+        prefix=SYSTEM_PROMPT_TEMPLATE.format(title=snapshot.title) + "\n\n",
+        entries=entries
+    )
+
+def _compile_outline(snapshot, retriever) -> CompiledPrompt:
+    entries, outline, depths = {}, {}, {}
+    # retriever.nodes is in preorder, so parents come before their children
+    for position, (node_id, node) in enumerate(retriever.nodes.items()):
+        parent_id = retriever.parents[node_id]
+        depths[node_id] = depths[parent_id] + 1 if parent_id is not None else 0
+        heading = f"{'  ' * depths[node_id]}- {node['label']}"
+        content = ' '.join(retriever.texts.get(node_id, '').split())
+        text = f"{heading}: {content}" if content else heading
+        entries[node_id] = (text, estimate_tokens(text))
+        outline[node_id] = (position, parent_id, heading)
+    return CompiledPrompt(
+        prefix=SYSTEM_PROMPT_TEMPLATE.format(title=snapshot.title) + "\n\n",
+        entries=entries,
+        kb_format='outline',
+        outline=outline
+    )
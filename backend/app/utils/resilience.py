@@ -0,0 +1,79 @@
+import threading
+import time
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. After `failure_threshold` failures in
+    a row it opens and rejects calls for `reset_timeout` seconds, then lets a
+    single trial call through (half-open): success closes it, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def configure(self, failure_threshold=None, reset_timeout=None):
+        if failure_threshold is not None:
+            self.failure_threshold = failure_threshold
+        if reset_timeout is not None:
+            self.reset_timeout = reset_timeout
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+            self.times_opened = 0
+            self.rejected = 0
+            self._trial_running = False
+
+    def allow(self):
+        """
+        True if a call may proceed. In half-open state only one trial runs at a time.
+        """
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._trial_running:
+                    self.rejected += 1
+                    return False
+                self._trial_running = True
+            return True
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != 'open':
+                return 0
+            return max(0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,121 @@
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from .text import html_to_text
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a al algo ante como con cual de del desde donde el ella ellos en entre era es esa ese eso esta
+este esto estos hay la las le les lo los me mi mas muy no nos o para pero por que quien se si
+sin sobre su sus te tu un una uno unos y ya
+an and are as at be by for from how in is it of on or the to what when where which who why with
+""".split())
+
+def tokenize(text: str) -> list:
+    """
+    Lowercases, strips accents and stopwords: "¿Qué son las Funciones?" -> ["son", "funciones"].
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in STOPWORDS]
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed set of documents. Postings are stored term-major in
+    NumPy arrays with their query-independent weights precomputed, so a search
+    is a handful of vectorized additions per query term.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.doc_ids = []
+        terms = {}
+        post_terms, post_docs, post_tfs, lengths = [], [], [], []
+
+        for i, (doc_id, text) in enumerate(documents):
+            tokens = tokenize(text)
+            self.doc_ids.append(doc_id)
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                post_terms.append(terms.setdefault(term, len(terms)))
+                post_docs.append(i)
+                post_tfs.append(tf)
+
+        order = np.argsort(np.asarray(post_terms, dtype=np.int64), kind='stable')
+        term_of_posting = np.asarray(post_terms, dtype=np.int64)[order]
+        self._terms = terms
+        self._docs = np.asarray(post_docs, dtype=np.int64)[order]
+        self._offsets = np.searchsorted(term_of_posting, np.arange(len(terms) + 1))
+
+        n = len(self.doc_ids)
+        lengths = np.asarray(lengths, dtype=np.float64)
+        avgdl = lengths.mean() if n and lengths.mean() > 0 else 1.0
+        df = np.diff(self._offsets)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+
+        tf = np.asarray(post_tfs, dtype=np.float64)[order]
+        norm = k1 * (1 - b + b * lengths[self._docs] / avgdl) if len(self._docs) else 0
+        self._weights = np.repeat(idf, df) * tf * (k1 + 1) / (tf + norm)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int = 5) -> list:
+        """
+        Returns up to k (doc_id, score) pairs with a positive score, best first.
+        """
+        if not self.doc_ids or k <= 0:
+            return []
+        scores = np.zeros(len(self.doc_ids))
+        for term in set(tokenize(query)):
+            t = self._terms.get(term)
+            if t is None:
+                continue
+            start, end = self._offsets[t], self._offsets[t + 1]
+            # Each document appears once per term, so plain fancy-index add is safe
+            scores[self._docs[start:end]] += self._weights[start:end]
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.doc_ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+class ChatbotRetriever:
+    """
+    BM25 index over the nodes of one chatbot snapshot, plus the parent map
+    needed to show where each hit sits in the tree. `texts` maps node ids to
+    the plain-text content precomputed at write time (derived from the HTML
+    when not given).
+    """
+
+    def __init__(self, tree: dict, texts: dict = None):
+        self.texts = texts if texts is not None else {}
+        self.nodes = {}
+        self.parents = {}
+        stack = [(tree, None)] if tree else []
+        while stack:
+            node, parent_id = stack.pop()
+            self.nodes[node['id']] = node
+            if texts is None:
+                self.texts[node['id']] = html_to_text(node.get('content') or '')
+            self.parents[node['id']] = parent_id
+            stack.extend((child, node['id']) for child in reversed(node.get('children', [])))
+
+        # The label is repeated so that title matches outrank passing mentions
+        self.index = BM25Index(
+            (node_id, f"{node['label']} {node['label']} {self.texts.get(node_id, '')}")
+            for node_id, node in self.nodes.items()
+        )
+
+    def search(self, query: str, k: int) -> list:
+        return [node_id for node_id, _ in self.index.search(query, k)]
+
+    def path_labels(self, node_id) -> list:
+        labels = []
+        while node_id is not None:
+            labels.append(self.nodes[node_id]['label'])
+            node_id = self.parents[node_id]
+        return labels[::-1]
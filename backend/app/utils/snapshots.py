@@ -0,0 +1,54 @@
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+from .text import html_to_text
+from .tree_parser import nodes_to_json
+
+@dataclass(frozen=True)
+class ChatbotSnapshot:
+    """
+    Immutable view of a chatbot at a given version: metadata, nested tree
+    and the tree already serialized to JSON. `tree` is shared between
+    readers and must be treated as read-only.
+    """
+    id: int
+    version: int
+    creator_id: int
+    title: str
+    description: Optional[str]
+    visibility: str
+    is_active: bool
+    ai_settings: dict
+    tree: Optional[dict]
+    tree_bytes: bytes
+    node_texts: dict  # node_id -> plain-text content
+
+    def metadata(self) -> dict:
+        return {
+            'id': self.id,
+            'title': self.title,
+            'description': self.description,
+            'visibility': self.visibility,
+            'creator_id': self.creator_id
+        }
+
+def build_snapshot(chatbot, nodes) -> ChatbotSnapshot:
+    tree = nodes_to_json(nodes)
+    return ChatbotSnapshot(
+        id=chatbot.id,
+        version=chatbot.version,
+        creator_id=chatbot.creator_id,
+        title=chatbot.title,
+        description=chatbot.description,
+        visibility=chatbot.visibility,
+        is_active=bool(chatbot.is_active),
+        ai_settings=dict(chatbot.ai_settings or {}),
+        tree=tree,
+        tree_bytes=json.dumps(tree, separators=(',', ':')).encode('utf-8'),
+        # Rows saved before content_text existed are converted once here
+        node_texts={
+            n.id: n.content_text if n.content_text is not None else html_to_text(n.content)
+            for n in nodes
+        }
+    )
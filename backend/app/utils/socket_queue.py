@@ -0,0 +1,127 @@
+import json
+import time
+import socketio
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Text, Float, select, delete, func, or_
+
+class SQLQueueManager(socketio.PubSubManager):
+    """
+    Socket.IO client manager that shares emits between worker processes
+    through a table in an SQL database (the app's Postgres, or a SQLite file
+    for local runs and tests). Publishing inserts a JSON row; every worker
+    polls for rows newer than the last one it saw and delivers them to its
+    own clients. Rows older than `retention` seconds are pruned.
+
+    Ids come from a sequence but concurrent inserts can commit out of order,
+    so ids skipped over by a poll are kept as gaps and asked for again on
+    the next polls, for up to `gap_timeout` seconds (rolled-back inserts
+    leave gaps that never fill).
+
+    Latency is bounded by `poll_interval`; prefer Redis (message_queue
+    redis://...) when it is available.
+    """
+    name = 'sql'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None, poll_interval=0.05, retention=60,
+                 gap_timeout=5, max_gaps=1000):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.gap_timeout = gap_timeout
+        self.max_gaps = max_gaps
+        self._gaps = {} # id -> when it was first skipped
+        self.engine = create_engine(url)
+        metadata = MetaData()
+        self.table = Table(
+            'socketio_queue', metadata,
+            Column('id', Integer, primary_key=True, autoincrement=True),
+            Column('channel', String(64), nullable=False, index=True),
+            Column('payload', Text, nullable=False),
+            Column('created_at', Float, nullable=False)
+        )
+        metadata.create_all(self.engine)
+        with self.engine.connect() as conn:
+            # Only messages published after this worker started are delivered
+            self._last_id = conn.execute(select(func.coalesce(func.max(self.table.c.id), 0))).scalar()
+        self._closed = False
+
+    def close(self):
+        self._closed = True
+
+    def _publish(self, data):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert().values(
+                channel=self.channel,
+                payload=json.dumps(data),
+                created_at=time.time()
+            ))
+
+    def _sleep(self):
+        if self.server is not None:
+            self.server.sleep(self.poll_interval)
+        else:
+            time.sleep(self.poll_interval)
+
+    def _poll(self):
+        """
+        Payloads of this channel committed since the previous poll, including
+        late commits of ids that were skipped before.
+        """
+        table = self.table
+        now = time.time()
+        for gap_id, skipped_at in list(self._gaps.items()):
+            if now - skipped_at > self.gap_timeout:
+                del self._gaps[gap_id]
+        condition = table.c.id > self._last_id
+        if self._gaps:
+            condition = or_(condition, table.c.id.in_(list(self._gaps)))
+        # Other channels share the id sequence, so their rows fill gaps too
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.channel, table.c.payload).where(condition).order_by(table.c.id)
+            ).all()
+
+        payloads = []
+        for row_id, channel, payload in rows:
+            if self._gaps.pop(row_id, None) is None:
+                if row_id <= self._last_id:
+                    continue
+                for gap_id in range(max(self._last_id + 1, row_id - self.max_gaps), row_id):
+                    self._gaps[gap_id] = now
+                self._last_id = row_id
+            if channel == self.channel:
+                payloads.append(payload)
+        while len(self._gaps) > self.max_gaps:
+            del self._gaps[min(self._gaps)]
+        return payloads
+
+    def _listen(self):
+        table = self.table
+        last_prune = time.time()
+        while not self._closed:
+            try:
+                for payload in self._poll():
+                    yield payload
+                if time.time() - last_prune > self.retention:
+                    last_prune = time.time()
+                    with self.engine.begin() as conn:
+                        conn.execute(delete(table).where(table.c.created_at < last_prune - self.retention))
+            except Exception as e:
+                self._get_logger().error(f"SQL queue error: {e}")
+            self._sleep()
+
+def create_client_manager(url, channel='socketio', write_only=False, database_url=None):
+    """
+    Client manager for SOCKETIO_MESSAGE_QUEUE, or None for the in-process
+    default. Accepted values: redis://, rediss:// (needs the redis package),
+    'sql' (the app database) and sql+<SQLAlchemy URL>.
+    """
+    if not url:
+        return None
+    if url.startswith(('redis://', 'rediss://')):
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    if url == 'sql':
+        return SQLQueueManager(database_url, channel=channel, write_only=write_only)
+    if url.startswith('sql+'):
+        return SQLQueueManager(url[len('sql+'):], channel=channel, write_only=write_only)
+    raise ValueError(f"SOCKETIO_MESSAGE_QUEUE no soportado: {url}")
@@ -0,0 +1,65 @@
+import re
+import unicodedata
+from html import unescape
+from html.parser import HTMLParser
+
+# Tags that start a new line when converted to plain text
+_BLOCK_TAGS = {'p', 'div', 'br', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'tr'}
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.parts.append(f' {href} ')
+
+    def handle_endtag(self, tag):
+        if tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+def html_to_text(html: str) -> str:
+    """
+    Converts TiptapEditor HTML into plain text, keeping line breaks between
+    blocks and link targets. Plain text input is returned normalized.
+    """
+    if not html:
+        return ''
+    if '<' not in html:
+        return unescape(html).strip()
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = ''.join(parser.parts)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'\s*\n\s*', '\n', text)
+    return text.strip()
+
+SUMMARY_LENGTH = 160
+
+def summarize_text(text: str, limit: int = SUMMARY_LENGTH) -> str:
+    """
+    One-line preview of plain text, cut at a word boundary with an ellipsis.
+    """
+    text = ' '.join((text or '').split())
+    if len(text) <= limit:
+        return text
+    cut = text[:limit - 1].rsplit(' ', 1)[0] or text[:limit - 1]
+    return cut.rstrip(' .,;:') + '…'
+
+def normalize_query(text: str) -> str:
+    """
+    Canonical form of a user question for cache keys: case, accents,
+    punctuation and spacing are ignored ("¿Qué es  Python?" -> "que es python").
+    """
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.findall(r"\w+", text))
@@ -0,0 +1,12 @@
+import math
+
+# Rough average for Spanish/English prose with Gemini-style tokenizers
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate used for prompt budgeting and accounting.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
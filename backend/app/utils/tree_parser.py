@@ -1,26 +1,109 @@
 # parse_indented_text removed as parsing is now handled by frontend
 
+class TreeValidationError(ValueError):
+    """
+    Raised by normalize_tree; `path` points at the offending element,
+    e.g. "tree_json.children[2].label".
+    """
+    def __init__(self, path: str, message: str):
+        self.path = path
+        super().__init__(f"{path}: {message}")
+
+DEFAULT_TREE_LIMITS = {
+    'max_nodes': 50000,
+    'max_depth': 50,
+    'max_label_length': 255,
+    'max_content_length': 100000,
+}
+
+def normalize_tree(tree: dict, max_nodes: int = None, max_depth: int = None,
+                   max_label_length: int = None, max_content_length: int = None) -> list:
+    """
+    Validates and normalizes a nested tree in one iterative breadth-first pass,
+    stopping at the first error or exceeded limit.
+
+    Returns the tree as a list of levels ready for bulk insertion. Each record is
+    a dict with label, content, id (int or None), position, parent (index in the
+    previous level or None) and children (indices in the next level).
+    """
+    max_nodes = max_nodes or DEFAULT_TREE_LIMITS['max_nodes']
+    max_depth = max_depth or DEFAULT_TREE_LIMITS['max_depth']
+    max_label_length = max_label_length or DEFAULT_TREE_LIMITS['max_label_length']
+    max_content_length = max_content_length or DEFAULT_TREE_LIMITS['max_content_length']
+
+    # Per level: (raw node, parent index, position, error path)
+    pending = [(tree, None, 0, 'tree_json')]
+    levels = []
+    count = 0
+
+    while pending:
+        if len(levels) >= max_depth:
+            raise TreeValidationError(pending[0][3], f"excede la profundidad máxima ({max_depth})")
+        count += len(pending)
+        if count > max_nodes:
+            raise TreeValidationError('tree_json', f"excede el máximo de {max_nodes} nodos")
+
+        level = []
+        next_pending = []
+        for raw, parent, position, path in pending:
+            if not isinstance(raw, dict):
+                raise TreeValidationError(path, "cada nodo debe ser un objeto")
+
+            label = raw.get('label')
+            if not isinstance(label, str) or not label.strip():
+                raise TreeValidationError(f"{path}.label", "se requiere un texto no vacío")
+            label = label.strip()
+            if len(label) > max_label_length:
+                raise TreeValidationError(f"{path}.label", f"excede {max_label_length} caracteres")
+
+            content = raw.get('content')
+            if content is None:
+                content = ''
+            if not isinstance(content, str):
+                raise TreeValidationError(f"{path}.content", "debe ser texto")
+            if len(content) > max_content_length:
+                raise TreeValidationError(f"{path}.content", f"excede {max_content_length} caracteres")
+
+            if 'children' not in raw:
+                raise TreeValidationError(f"{path}.children", "es obligatorio")
+            children = raw['children']
+            if not isinstance(children, list):
+                raise TreeValidationError(f"{path}.children", "debe ser una lista")
+
+            node_id = raw.get('id')
+            index = len(level)
+            level.append({
+                'label': label,
+                'content': content,
+                'id': node_id if isinstance(node_id, int) and not isinstance(node_id, bool) else None,
+                'position': position,
+                'parent': parent,
+                'children': list(range(len(next_pending), len(next_pending) + len(children)))
+            })
+            next_pending.extend(
+                (child, index, i, f"{path}.children[{i}]") for i, child in enumerate(children)
+            )
+
+        levels.append(level)
+        pending = next_pending
+
+    return levels
+
 def validate_tree(tree: dict) -> bool:
     """
     Validates that the tree has the required structure.
     """
-    if not isinstance(tree, dict):
-        return False
-    if "label" not in tree or "children" not in tree:
+    try:
+        normalize_tree(tree)
+    except TreeValidationError:
         return False
-    if not isinstance(tree["children"], list):
-        return False
-    
-    for child in tree["children"]:
-        if not validate_tree(child):
-            return False
-            
     return True
 
-def nodes_to_json(nodes: list) -> dict:
+def nodes_to_json(nodes: list, root_id: int = None) -> dict:
     """
     Converts a flat list of Node objects (with parent_node_id) into a nested dictionary.
-    Assumes a single root node exists in the list.
+    Assumes a single root node exists in the list, or uses `root_id` as the root
+    when the list is a subtree.
     """
     if not nodes:
         return None
@@ -39,7 +122,7 @@ def nodes_to_json(nodes: list) -> dict:
     
     for node in nodes:
         current = node_map[node.id]
-        if node.parent_node_id is None:
+        if node.id == root_id or (root_id is None and node.parent_node_id is None):
             root = current
         else:
             parent = node_map.get(node.parent_node_id)
@@ -47,3 +130,27 @@ def nodes_to_json(nodes: list) -> dict:
                 parent["children"].append(current)
                 
     return root
+
+# --- Materialized paths ---
+# Each segment is a node id zero-padded to a fixed width, so lexicographic
+# order matches tree order and a subtree is a contiguous range of paths.
+PATH_SEGMENT_WIDTH = 10
+# Length of Node.path; bounds how many levels a stored tree can have
+PATH_MAX_LENGTH = 1024
+MAX_TREE_DEPTH = PATH_MAX_LENGTH // PATH_SEGMENT_WIDTH
+
+def node_path(parent_path: str, node_id: int) -> str:
+    return (parent_path or '') + str(node_id).zfill(PATH_SEGMENT_WIDTH)
+
+def path_ids(path: str) -> list:
+    """
+    Returns the ids encoded in a path, root first.
+    """
+    return [int(path[i:i + PATH_SEGMENT_WIDTH]) for i in range(0, len(path), PATH_SEGMENT_WIDTH)]
+
+def path_upper_bound(path: str) -> str:
+    """
+    Smallest path greater than every descendant of `path` (exclusive bound).
+    """
+    last = path[-PATH_SEGMENT_WIDTH:]
+    return path[:-PATH_SEGMENT_WIDTH] + str(int(last) + 1).zfill(PATH_SEGMENT_WIDTH)
@@ -0,0 +1,9 @@
+# Gunicorn settings (see Procfile)
+
+def worker_exit(server, worker):
+    """
+    Persists chat messages still waiting in the write-behind buffer before
+    the worker process goes away (restart, deploy, scale down).
+    """
+    from backend.app.utils.message_buffer import message_buffer
+    message_buffer.close()
@@ -40,11 +40,16 @@ if os.environ.get("ENV", "local") == "local":
 
 # Ejecución local — Render no usa esto
 if __name__ == "__main__":
+    from backend.app.utils.message_buffer import message_buffer
     port = int(os.environ.get("PORT", 5000))
-    socketio.run(
-        app,
-        host="0.0.0.0",
-        port=port,
-        debug=False,
-        use_reloader=False
-    )
+    try:
+        socketio.run(
+            app,
+            host="0.0.0.0",
+            port=port,
+            debug=False,
+            use_reloader=False
+        )
+    finally:
+        # Persist chat messages still waiting in the write-behind buffer
+        message_buffer.close()
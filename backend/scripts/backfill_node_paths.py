@@ -0,0 +1,23 @@
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from app.models import Chatbot
+from app.services import rebuild_node_paths
+
+app = create_app()
+
+def backfill_node_paths():
+    """
+    Fills nodes.path / nodes.depth for chatbots created before the columns existed.
+    """
+    with app.app_context():
+        for chatbot in Chatbot.query.all():
+            count = rebuild_node_paths(chatbot.id)
+            print(f"Chatbot {chatbot.id} ({chatbot.title}): {count} nodos actualizados")
+
+if __name__ == "__main__":
+    backfill_node_paths()
@@ -0,0 +1,61 @@
+import sys
+import os
+import json
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from example_chatbots import EXAMPLE_CHATBOTS
+from app.utils.prompt_builder import compile_prompt, KB_FORMATS
+from app.utils.retrieval import ChatbotRetriever
+from app.utils.tokens import estimate_tokens
+
+def _with_ids(tree):
+    """
+    Copy of an uploaded tree with sequential ids, as stored trees have.
+    """
+    next_id = 1
+    root = dict(tree)
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node['id'] = next_id
+        next_id += 1
+        node['children'] = [dict(child) for child in node.get('children', [])]
+        stack.extend(reversed(node['children']))
+    return root
+
+def _row(name, text, baseline):
+    tokens = estimate_tokens(text)
+    reduction = 100 * (1 - tokens / baseline) if baseline else 0
+    return f"  {name:<22} {len(text):>7} chars {tokens:>6} tokens {reduction:>6.1f}% menos"
+
+def benchmark_kb_format():
+    """
+    Knowledge-base size per serialization for the example chatbots, with the
+    whole tree in the prompt, against json.dumps(tree_json, indent=2).
+    """
+    totals = {'tree_json (indent=2)': 0, **{kb_format: 0 for kb_format in KB_FORMATS}}
+    for example in EXAMPLE_CHATBOTS:
+        tree = _with_ids(example['tree_json'])
+        retriever = ChatbotRetriever(tree)
+        snapshot = SimpleNamespace(title=example['title'])
+        texts = {'tree_json (indent=2)': json.dumps(tree, indent=2, ensure_ascii=False)}
+        for kb_format in KB_FORMATS:
+            compiled = compile_prompt(snapshot, retriever, kb_format)
+            texts[kb_format] = compiled.render_kb(list(retriever.nodes))
+
+        baseline = estimate_tokens(texts['tree_json (indent=2)'])
+        print(f"{example['title']} ({len(retriever.nodes)} nodos)")
+        for name, text in texts.items():
+            print(_row(name, text, baseline))
+            totals[name] += estimate_tokens(text)
+
+    baseline = totals['tree_json (indent=2)']
+    print("Total")
+    for name, tokens in totals.items():
+        print(f"  {name:<22} {tokens:>20} tokens {100 * (1 - tokens / baseline):>6.1f}% menos")
+
+if __name__ == "__main__":
+    benchmark_kb_format()
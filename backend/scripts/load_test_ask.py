@@ -0,0 +1,93 @@
+import sys
+import os
+import argparse
+import threading
+import time
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Offline by default: the fake provider adds realistic latency without calling Gemini
+os.environ.setdefault('AI_PROVIDER', 'fake')
+
+from app import create_app, db
+from app.models import User, Node
+from app.services import register_user, create_chatbot, create_chat_session, save_message, ask_chatbot_session
+from app.utils.metrics import metrics
+
+app = create_app()
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def load_test(users, questions, stream):
+    """
+    Runs `users` concurrent conversations of `questions` turns each through
+    ask_chatbot_session and prints latency percentiles and provider counters.
+    """
+    with app.app_context():
+        suffix = int(time.time())
+        creator = register_user(f"load_creator_{suffix}", f"load_creator_{suffix}@example.com", "load", role='creator')
+        chatbot = create_chatbot(creator.id, "Load Test Bot", "Bot de prueba de carga", "private", {
+            "label": "Inicio",
+            "content": "Bienvenido al bot de prueba de carga.",
+            "children": [
+                {"label": f"Tema {i}", "content": f"Contenido del tema {i}.", "children": []}
+                for i in range(20)
+            ]
+        })
+        root_id = Node.query.filter_by(chatbot_id=chatbot.id, parent_node_id=None).first().id
+        sessions = []
+        for i in range(users):
+            user = register_user(f"load_user_{suffix}_{i}", f"load_user_{suffix}_{i}@example.com", "load")
+            sessions.append((user.id, create_chat_session(chatbot.id, user.id).id))
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def conversation(user_id, session_id, index):
+        with app.app_context():
+            for turn in range(questions):
+                query = f"Pregunta {turn} del usuario {index} sobre el tema {turn % 20}"
+                save_message(session_id, user_id, query)
+                started = time.perf_counter()
+                try:
+                    ask_chatbot_session(session_id, root_id, query, stream=stream)
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+            db.session.remove()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=conversation, args=(user_id, session_id, i))
+               for i, (user_id, session_id) in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"Proveedor: {app.config['AI_PROVIDER'] or 'auto'}  usuarios: {users}  preguntas/usuario: {questions}  stream: {stream}")
+    print(f"Completadas: {len(latencies)}  errores: {len(errors)}  duración: {elapsed:.2f}s  "
+          f"throughput: {len(latencies) / elapsed:.2f} resp/s")
+    if latencies:
+        print("Latencia (ms): p50={:.0f} p95={:.0f} p99={:.0f} max={:.0f}".format(
+            *(_percentile(latencies, p) * 1000 for p in (50, 95, 99)), max(latencies) * 1000
+        ))
+    collected = metrics.collect()
+    print(f"Proveedor: {collected['ai_provider']}")
+    for name in ('ask.generate', 'ask.total', 'ai.ttft'):
+        if name in collected['timings']:
+            print(f"{name}: {collected['timings'][name]}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga del flujo /ask con el proveedor configurado (AI_PROVIDER, fake por defecto).")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--stream', action='store_true')
+    args = parser.parse_args()
+    load_test(args.users, args.questions, args.stream)
@@ -0,0 +1,81 @@
+import sys
+import os
+
+# Add the parent directory to the path so we can import the app
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import inspect, text
+from app import create_app
+from app.models import db
+
+# Columns added to tables that db.create_all() does not alter once they exist
+NEW_COLUMNS = [
+    ('chatbots', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('chatbots', 'ai_settings', 'JSON'),
+    ('nodes', 'content_text', 'TEXT'),
+    ('nodes', 'summary', 'VARCHAR(255)'),
+    ('nodes', 'position', 'INTEGER NOT NULL DEFAULT 0'),
+    ('nodes', 'path', 'VARCHAR(1024)'),
+    ('nodes', 'depth', 'INTEGER NOT NULL DEFAULT 0'),
+    ('chat_sessions', 'summary', 'TEXT'),
+    ('chat_sessions', 'summary_message_id', 'INTEGER'),
+    ('chat_sessions', 'last_seq', 'INTEGER NOT NULL DEFAULT 0'),
+    ('messages', 'seq', 'INTEGER'),
+]
+
+NEW_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_nodes_chatbot_path ON nodes (chatbot_id, path)',
+    'CREATE INDEX IF NOT EXISTS ix_nodes_parent_position ON nodes (parent_node_id, position, id)',
+    'CREATE INDEX IF NOT EXISTS ix_messages_session_created ON messages (chat_session_id, created_at, id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ux_messages_session_seq ON messages (chat_session_id, seq)',
+]
+
+# Sessions with unnumbered messages are renumbered as a whole in (created_at, id)
+# order; clearing their seqs first keeps the unique index satisfied meanwhile.
+BACKFILL_SEQ = [
+    """
+    UPDATE messages SET seq = NULL
+    WHERE chat_session_id IN (SELECT DISTINCT chat_session_id FROM messages WHERE seq IS NULL)
+    """,
+    """
+    UPDATE messages SET seq = numbered.n
+    FROM (
+        SELECT id, row_number() OVER (PARTITION BY chat_session_id ORDER BY created_at, id) AS n
+        FROM messages
+        WHERE chat_session_id IN (SELECT DISTINCT chat_session_id FROM messages WHERE seq IS NULL)
+    ) AS numbered
+    WHERE messages.id = numbered.id
+    """,
+    """
+    UPDATE chat_sessions SET last_seq = COALESCE(
+        (SELECT MAX(seq) FROM messages WHERE messages.chat_session_id = chat_sessions.id), 0
+    )
+    """,
+]
+
+def upgrade_schema():
+    """
+    Brings a database created by an older version up to the current models.
+    Safe to run repeatedly: only missing columns are added, indexes use
+    IF NOT EXISTS and the seq backfill only touches unnumbered messages.
+    Afterwards run backfill_node_paths.py and backfill_node_text.py.
+    """
+    app = create_app()
+    with app.app_context():
+        existing = {
+            table: {c['name'] for c in inspect(db.engine).get_columns(table)}
+            for table in {table for table, _, _ in NEW_COLUMNS}
+        }
+        with db.engine.begin() as conn:
+            for table, column, ddl in NEW_COLUMNS:
+                if column not in existing[table]:
+                    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+                    print(f"{table}.{column} añadida")
+            for statement in BACKFILL_SEQ:
+                conn.execute(text(statement))
+            for statement in NEW_INDEXES:
+                conn.execute(text(statement))
+        print("Esquema actualizado")
+
+if __name__ == "__main__":
+    upgrade_schema()
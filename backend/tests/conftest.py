@@ -18,6 +18,30 @@ def app():
         db.session.remove()
         db.drop_all()
 
+@pytest.fixture
+def ai_client():
+    """
+    The AI client module; its provider options and circuit breaker are
+    restored after the test even when it fails.
+    """
+    from app.utils import ai_client
+    settings = {**ai_client._settings, 'fake': dict(ai_client._settings['fake'])}
+    threshold, reset_timeout = ai_client.breaker.failure_threshold, ai_client.breaker.reset_timeout
+    yield ai_client
+    ai_client._settings.update(settings)
+    ai_client.configure_client()
+    ai_client.breaker.configure(failure_threshold=threshold, reset_timeout=reset_timeout)
+
+@pytest.fixture
+def ai_jobs():
+    """
+    The AI job queue, with its worker and size limits restored after the test.
+    """
+    from app.utils.jobs import ai_jobs
+    workers, maxsize = ai_jobs.workers, ai_jobs.maxsize
+    yield ai_jobs
+    ai_jobs.workers, ai_jobs.maxsize = workers, maxsize
+
 @pytest.fixture
 def client(app):
     return app.test_client()
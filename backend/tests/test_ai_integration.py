@@ -51,3 +51,315 @@ def test_ask_chatbot_session_invalid_node(app):
         
         with pytest.raises(ValueError, match="Node not found"):
             ask_chatbot_session(session.id, 9999, "Query")
+
+def test_ask_chatbot_session_sends_only_relevant_nodes(app):
+    with app.app_context():
+        user = register_user("creator_ai3", "ai3@example.com", "pass")
+        tree_json = {
+            "label": "Python",
+            "content": "Lenguaje versátil",
+            "children": [
+                {"label": "Bucles", "content": "Repite código con for y while", "children": []},
+                {"label": "Variables", "content": "Almacenan datos", "children": []},
+                {"label": "Decoradores", "content": "Envuelven funciones", "children": []}
+            ]
+        }
+        chatbot = create_chatbot(user.id, "Retrieval Bot", "Desc", "public", tree_json,
+                                 ai_settings={"retrieval_top_k": 1})
+        session = create_chat_session(chatbot.id, user.id, 'ai_conversation')
+        root_node = Node.query.filter_by(chatbot_id=chatbot.id, label="Python").first()
+
+        with unittest.mock.patch('app.services.generate_response', return_value="ok") as mock_generate:
+            ask_chatbot_session(session.id, root_node.id, "¿Cómo uso while?")
+
+        context = mock_generate.call_args[0][0]
+        assert "Bucles" in context
+        assert "Decoradores" not in context
+        assert "Variables" not in context
+
+def test_ask_chatbot_session_reuses_compiled_prompt(app):
+    from app.utils.cache import prompt_cache
+    from app.utils.metrics import metrics
+
+    with app.app_context():
+        user = register_user("creator_ai4", "ai4@example.com", "pass")
+        chatbot = create_chatbot(user.id, "Prompt Bot", "Desc", "public",
+                                 {"label": "Root", "content": "Raíz", "children": []})
+        session = create_chat_session(chatbot.id, user.id, 'ai_conversation')
+        root_node = Node.query.filter_by(chatbot_id=chatbot.id).first()
+        prompt_cache.configure()
+
+        with unittest.mock.patch('app.services.generate_response', return_value="ok") as mock_generate:
+            ask_chatbot_session(session.id, root_node.id, "Primera")
+            ask_chatbot_session(session.id, root_node.id, "Segunda")
+
+        assert prompt_cache.stats()['misses'] == 1
+        assert prompt_cache.stats()['hits'] == 1
+        context = mock_generate.call_args[0][0]
+        assert context.startswith("Eres un asistente de soporte útil para el chatbot 'Prompt Bot'.")
+        assert "--- Historial de Conversación ---\nIA: ok\n" in context
+
+        timings = metrics.collect()['timings']
+        for stage in ('session', 'context', 'history', 'retrieval', 'prompt', 'generate', 'persist', 'total'):
+            assert timings[f'ask.{stage}']['count'] >= 2
+
+def test_answer_cache_serves_repeated_questions(app):
+    from app.services import update_chatbot
+    from app.utils.cache import answer_cache
+
+    with app.app_context():
+        creator = register_user("creator_ai5", "ai5@example.com", "pass")
+        visitor = register_user("visitor_ai5", "v5@example.com", "pass")
+        tree_json = {"label": "Root", "content": "Raíz", "children": []}
+        chatbot = create_chatbot(creator.id, "Cache Bot", "Desc", "public", tree_json)
+        root_node = Node.query.filter_by(chatbot_id=chatbot.id).first()
+        first = create_chat_session(chatbot.id, creator.id, 'ai_conversation')
+        second = create_chat_session(chatbot.id, visitor.id, 'ai_conversation')
+        answer_cache.configure()
+
+        with unittest.mock.patch('app.services.generate_response', return_value="Respuesta") as mock_generate:
+            ask_chatbot_session(first.id, root_node.id, "¿Qué es esto?")
+            assert ask_chatbot_session(second.id, root_node.id, "que es esto") == "Respuesta"
+            assert mock_generate.call_count == 1
+            assert Message.query.filter_by(chat_session_id=second.id, sender_type='ai').count() == 1
+
+            # Tree updates purge the chatbot's cached answers
+            update_chatbot(chatbot.id, creator.id, "Cache Bot", "Desc", "public", tree_json)
+            assert len(answer_cache) == 0
+
+            # Per-chatbot opt-out
+            update_chatbot(chatbot.id, creator.id, "Cache Bot", "Desc", "public", None,
+                           ai_settings={"answer_cache": False})
+            third = create_chat_session(chatbot.id, None, 'ai_conversation')
+            ask_chatbot_session(third.id, root_node.id, "¿Qué es esto?")
+            ask_chatbot_session(third.id, root_node.id, "¿Qué es esto?")
+            assert mock_generate.call_count == 3
+
+def test_ask_chatbot_session_streams_chunks_to_room(app):
+    from app import socketio
+    from app.utils.metrics import metrics
+
+    with app.app_context():
+        user = register_user("creator_ai6", "ai6@example.com", "pass")
+        chatbot = create_chatbot(user.id, "Stream Bot", "Desc", "public",
+                                 {"label": "Root", "content": "Raíz", "children": []})
+        session = create_chat_session(chatbot.id, user.id, 'ai_conversation')
+        root_node = Node.query.filter_by(chatbot_id=chatbot.id).first()
+
+        client = socketio.test_client(app)
+        client.emit('join', {'session_id': session.id, 'user_id': user.id})
+        client.get_received()
+
+        with unittest.mock.patch('app.services.stream_response', return_value=iter(["Hola", " mundo"])):
+            response = ask_chatbot_session(session.id, root_node.id, "Saluda", stream=True)
+
+        assert response == "Hola mundo"
+        received = client.get_received()
+        chunks = [e['args'][0] for e in received if e['name'] == 'ai_chunk']
+        assert [c['delta'] for c in chunks] == ["Hola", " mundo"]
+        final = [e['args'] for e in received if e['name'] == 'message'][-1] # 'message' args arrive unwrapped
+        assert final['content'] == "Hola mundo"
+        assert final['stream_id'] == chunks[0]['stream_id']
+        assert Message.query.filter_by(chat_session_id=session.id, sender_type='ai').count() == 1
+        assert metrics.timings()['ai.ttft']['count'] >= 1
+        client.disconnect()
+
+def test_gemini_client_is_created_once_and_calls_use_timeout(app, ai_client):
+    with unittest.mock.patch('app.utils.ai_client.genai') as mock_genai:
+        mock_model = mock_genai.GenerativeModel.return_value
+        mock_model.generate_content.return_value.text = "Respuesta"
+        with unittest.mock.patch.dict(os.environ, {'GEMINI_API_KEY': 'test_key'}):
+            ai_client.configure_client(timeout=12)
+            assert ai_client.warm_up() is True
+            assert ai_client.generate_response("ctx", "q1") == "Respuesta"
+            assert ai_client.generate_response("ctx", "q2") == "Respuesta"
+
+        mock_genai.configure.assert_called_once_with(api_key='test_key', transport='rest')
+        mock_genai.GenerativeModel.assert_called_once()
+        _, kwargs = mock_model.generate_content.call_args
+        assert kwargs['request_options'] == {'timeout': 12}
+
+def test_identical_concurrent_questions_share_one_provider_call(app):
+    import threading
+    import time
+    from app.utils.singleflight import ai_flights
+
+    with app.app_context():
+        user = register_user("creator_ai7", "ai7@example.com", "pass")
+        chatbot = create_chatbot(user.id, "Viral Bot", "Desc", "public",
+                                 {"label": "Root", "content": "Raíz", "children": []})
+        root_id = Node.query.filter_by(chatbot_id=chatbot.id).first().id
+        visitors = [register_user(f"visitor_ai7_{i}", f"v7_{i}@example.com", "pass") for i in range(2)]
+        session_ids = [create_chat_session(chatbot.id, v.id, 'ai_conversation').id for v in visitors]
+
+    calls = []
+    def slow_provider(context, query):
+        calls.append(query)
+        # Hold the call open until the second request has joined it
+        deadline = time.time() + 5
+        while ai_flights.stats()['followers'] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        return "Respuesta compartida"
+
+    results = {}
+    def ask(session_id, query):
+        with app.app_context():
+            results[session_id] = ask_chatbot_session(session_id, root_id, query)
+
+    with unittest.mock.patch('app.services.generate_response', side_effect=slow_provider):
+        threads = [threading.Thread(target=ask, args=(sid, q)) for sid, q in zip(session_ids, ["¿Qué es esto?", "que es esto"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(calls) == 1
+    assert results == {sid: "Respuesta compartida" for sid in session_ids}
+    with app.app_context():
+        for sid in session_ids:
+            assert Message.query.filter_by(chat_session_id=sid, sender_type='ai').count() == 1
+
+def test_long_history_is_summarized_and_prompt_stays_within_budget(app):
+    from app.services import save_message, summarize_session, get_chat_session
+
+    with app.app_context():
+        app.config['AI_HISTORY_MESSAGES'] = 4
+        app.config['AI_HISTORY_TOKEN_BUDGET'] = 200
+        app.config['AI_SUMMARY_TRIGGER_TOKENS'] = 50
+        user = register_user("creator_ai8", "ai8@example.com", "pass")
+        chatbot = create_chatbot(user.id, "Long Bot", "Desc", "public",
+                                 {"label": "Root", "content": "Raíz", "children": []})
+        session = create_chat_session(chatbot.id, user.id, 'ai_conversation')
+        root_id = Node.query.filter_by(chatbot_id=chatbot.id).first().id
+        for i in range(10):
+            save_message(session.id, user.id, f"mensaje antiguo {i} " + "x" * 80)
+
+        with unittest.mock.patch('app.services.schedule_session_summary') as schedule, \
+             unittest.mock.patch('app.services.generate_response', return_value="Respuesta") as generate:
+            save_message(session.id, user.id, "pregunta nueva")
+            ask_chatbot_session(session.id, root_id, "pregunta nueva")
+            context = generate.call_args[0][0]
+            assert "mensaje antiguo 0" not in context
+            assert "pregunta nueva" in context
+            schedule.assert_called_once_with(session.id)
+
+        with unittest.mock.patch('app.services.generate_response', return_value="El usuario envió mensajes antiguos."):
+            assert summarize_session(session.id) is True
+        session = get_chat_session(session.id)
+        assert session.summary == "El usuario envió mensajes antiguos."
+        assert session.summary_message_id is not None
+
+        with unittest.mock.patch('app.services.generate_response', return_value="Respuesta") as generate:
+            ask_chatbot_session(session.id, root_id, "otra pregunta")
+            assert "Resumen de la conversación anterior: El usuario envió mensajes antiguos." in generate.call_args[0][0]
+
+def test_fake_provider_is_selected_by_config_and_counts_tokens(app, ai_client):
+    ai_client.configure_client(provider='fake', fake_options={
+        'latency_ms': 0, 'tokens': 5, 'tokens_per_second': 0, 'error_rate': 0.0, 'seed': 1
+    })
+    assert ai_client.get_provider().name == 'fake'
+
+    answer = ai_client.generate_response("ctx", "pregunta")
+    assert answer.startswith("[FAKE]") and len(answer.split()) == 5
+    assert ''.join(ai_client.stream_response("ctx", "pregunta")).startswith("[FAKE]")
+
+    ai_client.configure_client(fake_options={'latency_ms': 0, 'error_rate': 1.0}, retries=0)
+    with pytest.raises(ai_client.AIProviderError):
+        ai_client.generate_response("ctx", "pregunta")
+
+    stats = ai_client.usage.stats()
+    assert stats['provider'] == 'fake'
+    assert stats['calls'] == 1 and stats['errors'] == 1
+
+def test_provider_failures_retry_then_open_the_breaker(app, ai_client):
+    ai_client.configure_client(provider='fake', fake_options={'latency_ms': 0, 'tokens_per_second': 0, 'seed': 2},
+                               retries=1, backoff=0)
+    ai_client.breaker.configure(failure_threshold=3, reset_timeout=60)
+    provider = ai_client.get_provider()
+
+    # One transient failure is absorbed by the retry
+    with unittest.mock.patch.object(provider, 'generate', side_effect=[RuntimeError("503"), "Respuesta"]):
+        assert ai_client.generate_response("ctx", "q") == "Respuesta"
+    assert ai_client.usage.stats()['retries'] == 1
+
+    with unittest.mock.patch.object(provider, 'generate', side_effect=RuntimeError("503")) as generate:
+        with pytest.raises(ai_client.AIProviderError) as failure:
+            ai_client.generate_response("ctx", "q")
+        assert failure.value.reason == 'provider_error'
+        with pytest.raises(ai_client.AIProviderError):
+            ai_client.generate_response("ctx", "q")
+        calls = generate.call_count
+
+        # Open: fails fast without calling the provider
+        with pytest.raises(ai_client.AIProviderError) as failure:
+            ai_client.generate_response("ctx", "q")
+        assert failure.value.reason == 'circuit_open'
+        assert generate.call_count == calls
+    assert ai_client.breaker.stats()['state'] == 'open'
+
+def test_slow_provider_call_is_hedged_and_bounded_by_deadline(app, ai_client):
+    import time
+
+    ai_client.configure_client(provider='fake', fake_options={'latency_ms': 0, 'tokens_per_second': 0},
+                               retries=0, hedge_after=0.05, deadline=0.5)
+    provider = ai_client.get_provider()
+    responses = iter([5.0, 0.0])
+    def generate(context, query, timeout=None):
+        time.sleep(next(responses))
+        return "Respuesta rápida"
+
+    with unittest.mock.patch.object(provider, 'generate', side_effect=generate):
+        assert ai_client.generate_response("ctx", "q") == "Respuesta rápida"
+    assert ai_client.usage.stats()['hedges'] == 1
+
+    with unittest.mock.patch.object(provider, 'generate', side_effect=lambda *a: time.sleep(2)):
+        with pytest.raises(ai_client.AIProviderError) as failure:
+            ai_client.generate_response("ctx", "q")
+    assert failure.value.reason == 'timeout'
+
+def test_slow_stream_first_chunk_is_bounded_by_deadline(app, ai_client):
+    import time
+
+    ai_client.configure_client(provider='fake', fake_options={'latency_ms': 0, 'tokens_per_second': 0},
+                               retries=0, deadline=0.3)
+    provider = ai_client.get_provider()
+    def stream(context, query, timeout=None):
+        time.sleep(2) # ignores the timeout
+        yield "tarde"
+
+    started = time.monotonic()
+    with unittest.mock.patch.object(provider, 'stream', side_effect=stream):
+        with pytest.raises(ai_client.AIProviderError) as failure:
+            list(ai_client.stream_response("ctx", "q"))
+    assert failure.value.reason == 'timeout'
+    assert time.monotonic() - started < 1.5
+
+    # The fake provider gives up at the timeout instead of sleeping on
+    ai_client.configure_client(fake_options={'latency_ms': 5000, 'sigma': 0}, deadline=0.3)
+    started = time.monotonic()
+    with pytest.raises(ai_client.AIProviderError):
+        list(ai_client.stream_response("ctx", "q"))
+    assert time.monotonic() - started < 1.5
+
+def test_provider_without_generate_fails_when_instantiated(ai_client):
+    class Incomplete(ai_client.AIProvider):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_provider_failure_is_not_saved_as_message(app):
+    from app.utils.ai_client import AIProviderError
+
+    with app.app_context():
+        user = register_user("creator_ai9", "ai9@example.com", "pass")
+        chatbot = create_chatbot(user.id, "Down Bot", "Desc", "public",
+                                 {"label": "Root", "content": "Raíz", "children": []})
+        session = create_chat_session(chatbot.id, user.id, 'ai_conversation')
+        root_id = Node.query.filter_by(chatbot_id=chatbot.id).first().id
+
+        with unittest.mock.patch('app.services.generate_response',
+                                 side_effect=AIProviderError('circuit_open', "No disponible", retry_after=30)):
+            with pytest.raises(AIProviderError):
+                ask_chatbot_session(session.id, root_id, "Hola")
+        assert Message.query.filter_by(chat_session_id=session.id, sender_type='ai').count() == 0
@@ -61,3 +61,32 @@ def test_resolve_chat_session_unauthorized(app):
         # Try to resolve as unrelated user
         with pytest.raises(ValueError, match="Unauthorized"):
             resolve_chat_session(session.id, other.id)
+
+def test_session_access_is_cached_and_invalidated(app):
+    from app.services import invalidate_session_access
+    from app.utils.cache import session_access_cache
+
+    with app.app_context():
+        creator = User(username='creator', email='c@test.com', password_hash='hash', role='creator')
+        user = User(username='user', email='u@test.com', password_hash='hash', role='user')
+        other = User(username='other', email='o@test.com', password_hash='hash', role='user')
+        db.session.add_all([creator, user, other])
+        db.session.commit()
+
+        bot = Chatbot(creator_id=creator.id, title='Bot', visibility='public')
+        db.session.add(bot)
+        db.session.commit()
+        session = create_chat_session(bot.id, user.id)
+
+        assert validate_session_access(session.id, user.id)
+        assert validate_session_access(session.id, creator.id)
+        assert not validate_session_access(session.id, other.id)
+        stats = session_access_cache.stats()
+        assert stats['misses'] == 1 and stats['hits'] == 2
+
+        resolve_chat_session(session.id, creator.id)
+        assert session_access_cache.get(session.id) is None
+
+        validate_session_access(session.id, user.id)
+        invalidate_session_access(chatbot_id=bot.id)
+        assert len(session_access_cache) == 0
@@ -69,3 +69,219 @@ def test_delete_chatbot(app):
         
         assert get_chatbot(chatbot.id) is None
         assert len(Node.query.filter_by(chatbot_id=chatbot.id).all()) == 0
+
+def test_create_chatbot_bulk_tree_matches_input(app):
+    with app.app_context():
+        user = register_user("creator6", "creator6@example.com", "pass")
+        tree_json = {
+            "label": "Root",
+            "content": "R",
+            "children": [
+                {"label": f"Child {i}", "content": f"C{i}", "children": [
+                    {"label": f"Leaf {i}.{j}", "children": []} for j in range(3)
+                ]} for i in range(4)
+            ]
+        }
+        chatbot = create_chatbot(user.id, "Bulk Bot", "Desc", "public", tree_json)
+
+        def strip_ids(node):
+            return {
+                "label": node["label"],
+                "content": node["content"],
+                "children": [strip_ids(c) for c in node["children"]]
+            }
+
+        expected = {
+            "label": "Root",
+            "content": "R",
+            "children": [
+                {"label": f"Child {i}", "content": f"C{i}", "children": [
+                    {"label": f"Leaf {i}.{j}", "content": "", "children": []} for j in range(3)
+                ]} for i in range(4)
+            ]
+        }
+        assert strip_ids(get_chatbot_tree(chatbot.id)) == expected
+        assert Node.query.filter_by(chatbot_id=chatbot.id).count() == 17
+
+def test_chatbot_snapshot_cache_hits_and_invalidation(app):
+    from app.services import get_chatbot_snapshot, update_chatbot
+    from app.utils.cache import chatbot_cache
+
+    with app.app_context():
+        user = register_user("creator7", "creator7@example.com", "pass")
+        chatbot = create_chatbot(user.id, "Cached Bot", "Desc", "public", {"label": "Root", "children": []})
+        chatbot_cache.configure()
+
+        first = get_chatbot_snapshot(chatbot.id)
+        second = get_chatbot_snapshot(chatbot.id)
+        assert first is second
+        assert chatbot_cache.stats()['hits'] == 1
+        assert chatbot_cache.stats()['misses'] == 1
+
+        update_chatbot(chatbot.id, user.id, "Renamed", "Desc", "public", {"label": "New Root", "children": []})
+        updated = get_chatbot_snapshot(chatbot.id)
+        assert updated.version == first.version + 1
+        assert updated.title == "Renamed"
+        assert updated.tree['label'] == "New Root"
+
+        delete_chatbot(chatbot.id, user.id)
+        assert get_chatbot_snapshot(chatbot.id) is None
+        assert len(chatbot_cache) == 0
+
+def test_lru_cache_evicts_oldest():
+    from app.utils.cache import LRUCache
+
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+def test_update_chatbot_keeps_ids_of_unchanged_nodes(app):
+    from app.services import update_chatbot
+
+    with app.app_context():
+        user = register_user("creator8", "creator8@example.com", "pass")
+        tree_json = {
+            "label": "Root",
+            "content": "R",
+            "children": [
+                {"label": "A", "content": "typo", "children": [
+                    {"label": "A1", "children": []}
+                ]},
+                {"label": "B", "children": []},
+                {"label": "C", "children": []}
+            ]
+        }
+        chatbot = create_chatbot(user.id, "Diff Bot", "Desc", "public", tree_json)
+        before = {n.label: n.id for n in Node.query.filter_by(chatbot_id=chatbot.id).all()}
+
+        edited = {
+            "label": "Root",
+            "content": "R",
+            "children": [
+                {"label": "A", "content": "fixed", "children": []},
+                {"label": "C", "children": [
+                    {"label": "New", "children": [{"label": "Newer", "children": []}]},
+                    {"label": "A1", "id": before["A1"], "children": []}
+                ]}
+            ]
+        }
+        update_chatbot(chatbot.id, user.id, "Diff Bot", "Desc", "public", edited)
+
+        after = {n.label: n for n in Node.query.filter_by(chatbot_id=chatbot.id).all()}
+        assert set(after) == {"Root", "A", "C", "A1", "New", "Newer"}
+        for label in ("Root", "A", "C", "A1"):
+            assert after[label].id == before[label]
+        assert after["A"].content == "fixed"
+        assert after["A1"].parent_node_id == before["C"]
+        assert after["New"].parent_node_id == before["C"]
+        assert after["Newer"].parent_node_id == after["New"].id
+
+        tree = get_chatbot_tree(chatbot.id)
+        assert [c["label"] for c in tree["children"]] == ["A", "C"]
+        assert [c["label"] for c in tree["children"][1]["children"]] == ["New", "A1"]
+
+def test_node_paths_ancestors_and_subtree(app):
+    from app.services import get_node_ancestors, get_node_subtree, update_chatbot, rebuild_node_paths
+
+    with app.app_context():
+        user = register_user("creator9", "creator9@example.com", "pass")
+        tree_json = {"label": "Root", "children": [
+            {"label": "A", "children": [
+                {"label": "A1", "children": [{"label": "A1x", "children": []}]}
+            ]},
+            {"label": "B", "children": []}
+        ]}
+        chatbot = create_chatbot(user.id, "Path Bot", "Desc", "public", tree_json)
+        nodes = {n.label: n for n in Node.query.filter_by(chatbot_id=chatbot.id).all()}
+
+        assert [n.label for n in get_node_ancestors(nodes["A1x"])] == ["Root", "A", "A1", "A1x"]
+        assert nodes["A1x"].depth == 3
+
+        subtree = get_node_subtree(nodes["A"].id, max_depth=1)
+        assert subtree["label"] == "A"
+        assert [c["label"] for c in subtree["children"]] == ["A1"]
+        assert subtree["children"][0]["children"] == []
+
+        # Moving A1 under B rewrites the paths of the whole moved subtree
+        moved = {"label": "Root", "children": [
+            {"label": "A", "children": []},
+            {"label": "B", "children": [
+                {"label": "A1", "id": nodes["A1"].id, "children": [{"label": "A1x", "children": []}]}
+            ]}
+        ]}
+        update_chatbot(chatbot.id, user.id, "Path Bot", "Desc", "public", moved)
+        assert [n.label for n in get_node_ancestors(nodes["A1x"].id)] == ["Root", "B", "A1", "A1x"]
+        assert get_node_subtree(nodes["A"].id)["children"] == []
+
+        paths_before = {n.id: (n.path, n.depth) for n in Node.query.filter_by(chatbot_id=chatbot.id).all()}
+        assert rebuild_node_paths(chatbot.id) == 5
+        paths_after = {n.id: (n.path, n.depth) for n in Node.query.filter_by(chatbot_id=chatbot.id).all()}
+        assert paths_after == paths_before
+
+def test_lru_cache_ttl_expires_entries():
+    from unittest import mock
+    from app.utils.cache import LRUCache
+
+    cache = LRUCache(maxsize=2, ttl=10)
+    with mock.patch('app.utils.cache.time.monotonic', return_value=100.0):
+        cache.set('a', 1)
+    with mock.patch('app.utils.cache.time.monotonic', return_value=105.0):
+        assert cache.get('a') == 1
+    with mock.patch('app.utils.cache.time.monotonic', return_value=111.0):
+        assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+def test_update_chatbot_matches_wide_levels_by_label(app):
+    from app.services import update_chatbot
+
+    with app.app_context():
+        user = register_user("creator_wide", "creator_wide@example.com", "pass")
+        children = [{"label": f"Item {i % 500}", "children": []} for i in range(1000)]
+        chatbot = create_chatbot(user.id, "Wide Bot", "Desc", "public", {"label": "Root", "children": children})
+        before = [n.id for n in Node.query.filter(Node.chatbot_id == chatbot.id, Node.parent_node_id.isnot(None)).order_by(Node.position)]
+
+        # Reversed order: every child is found by label, duplicates in stored order
+        update_chatbot(chatbot.id, user.id, "Wide Bot", "Desc", "public", {"label": "Root", "children": children[::-1]})
+        after = Node.query.filter(Node.chatbot_id == chatbot.id, Node.parent_node_id.isnot(None)).order_by(Node.position).all()
+        assert sorted(n.id for n in after) == sorted(before)
+        assert [n.label for n in after] == [c["label"] for c in children[::-1]]
+
+def test_node_plain_text_is_derived_on_save_and_update(app):
+    from app.services import update_chatbot, get_node_children, get_chatbot_snapshot
+
+    with app.app_context():
+        user = register_user("textcreator", "text@example.com", "pass")
+        chatbot = create_chatbot(user.id, "Text Bot", "Desc", "public", {
+            "label": "Root", "content": "<p>Hola <strong>mundo</strong></p>", "children": [
+                {"label": "Largo", "content": "<p>" + "palabra " * 60 + "</p>", "children": []}
+            ]
+        })
+        root = Node.query.filter_by(chatbot_id=chatbot.id, parent_node_id=None).first()
+        assert root.content_text == "Hola mundo"
+        assert root.summary == "Hola mundo"
+        long_node = Node.query.filter_by(chatbot_id=chatbot.id, label="Largo").first()
+        assert len(long_node.summary) <= 160 and long_node.summary.endswith('…')
+
+        update_chatbot(chatbot.id, user.id, "Text Bot", "Desc", "public", tree_json={
+            "label": "Root", "content": "<p>Adiós</p>", "children": [{"label": "Largo", "content": "", "children": []}]
+        })
+        root = Node.query.filter_by(chatbot_id=chatbot.id, parent_node_id=None).first()
+        assert root.content_text == "Adiós"
+        assert get_chatbot_snapshot(chatbot.id).node_texts[root.id] == "Adiós"
+
+        view = get_node_children(chatbot.id, include_content=False)
+        assert 'content' not in view and view['summary'] == "Adiós"
+
+def test_tree_max_depth_is_capped_by_path_length(monkeypatch):
+    from app import create_app
+    from app.utils.tree_parser import MAX_TREE_DEPTH, PATH_MAX_LENGTH, PATH_SEGMENT_WIDTH
+
+    monkeypatch.setenv('TREE_MAX_DEPTH', '500')
+    app = create_app()
+    assert app.config['TREE_MAX_DEPTH'] == MAX_TREE_DEPTH
+    assert MAX_TREE_DEPTH * PATH_SEGMENT_WIDTH <= PATH_MAX_LENGTH
@@ -0,0 +1,67 @@
+from app import socketio
+from app.services import (
+    register_user, create_chatbot, create_chat_session, resolve_chat_session, notify_creator_inbox
+)
+
+def _events(client, name):
+    return [e['args'][0] for e in client.get_received() if e['name'] == name]
+
+def _logged_in_socket(app, username):
+    http = app.test_client()
+    http.post('/api/auth/login', json={"username": username, "password": "pass"})
+    return socketio.test_client(app, flask_test_client=http)
+
+def test_creator_inbox_receives_snapshot_and_deltas(app):
+    with app.app_context():
+        creator = register_user("inboxcreator", "inboxcreator@example.com", "pass", role="creator")
+        user = register_user("inboxuser", "inboxuser@example.com", "pass")
+        chatbot = create_chatbot(creator.id, "Inbox Bot", "Desc", "public", {"label": "Root", "children": []})
+        session = create_chat_session(chatbot.id, user.id)
+
+        inbox = _logged_in_socket(app, "inboxcreator")
+        inbox.emit('join_inbox')
+        assert _events(inbox, 'inbox_snapshot') == [{'sessions': []}]
+
+        chat = socketio.test_client(app)
+        chat.emit('join', {'session_id': session.id, 'user_id': user.id})
+        chat.emit('request_human', {'session_id': session.id, 'user_id': user.id})
+        chat.emit('message', {'session_id': session.id, 'user_id': user.id, 'content': "Hola"})
+        received = inbox.get_received()
+        assert [e['name'] for e in received] == ['inbox_upsert', 'inbox_message']
+        assert received[0]['args'][0]['chatbot_title'] == "Inbox Bot"
+        assert received[1]['args'][0] == {'id': session.id, 'last_seq': 1}
+
+        # Reconnecting creators get the current state in one snapshot
+        inbox.emit('join_inbox')
+        assert [s['id'] for s in _events(inbox, 'inbox_snapshot')[0]['sessions']] == [session.id]
+
+        resolve_chat_session(session.id, creator.id)
+        assert _events(inbox, 'inbox_remove') == [{'id': session.id}]
+
+        # Only creators can subscribe
+        outsider = _logged_in_socket(app, "inboxuser")
+        outsider.emit('join_inbox')
+        assert _events(outsider, 'error') == [{'msg': 'No autorizado'}]
+        for client in (inbox, chat, outsider):
+            client.disconnect()
+
+def test_join_inbox_ignores_a_spoofed_user_id(app):
+    with app.app_context():
+        creator = register_user("spoofcreator", "spoofcreator@example.com", "pass", role="creator")
+        register_user("spoofer", "spoofer@example.com", "pass")
+        chatbot = create_chatbot(creator.id, "Spoof Bot", "Desc", "public", {"label": "Root", "children": []})
+
+        anonymous = socketio.test_client(app)
+        anonymous.emit('join_inbox', {'user_id': creator.id})
+        assert _events(anonymous, 'error') == [{'msg': 'No autorizado'}]
+
+        spoofer = _logged_in_socket(app, "spoofer")
+        spoofer.emit('join_inbox', {'user_id': creator.id})
+        assert _events(spoofer, 'error') == [{'msg': 'No autorizado'}]
+
+        # Neither joined the creator's room
+        session = create_chat_session(chatbot.id, creator.id)
+        notify_creator_inbox(session, 'remove')
+        assert anonymous.get_received() == [] and spoofer.get_received() == []
+        for client in (anonymous, spoofer):
+            client.disconnect()
@@ -0,0 +1,137 @@
+import pytest
+import unittest.mock
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from app import socketio
+from app.models import db, Message, ChatSession
+from app.services import register_user, create_chatbot, create_chat_session, get_session_messages
+from app.utils.message_buffer import message_buffer
+
+@pytest.fixture
+def buffered(app):
+    """
+    Enables the write-behind buffer (no timed flushes); returns a function to
+    change the batch size. Disabled again after the test.
+    """
+    def enable(batch_size=100):
+        message_buffer.configure(app, socketio, Message.__table__, enabled=True, batch_size=batch_size, interval=60,
+                                 sessions_table=ChatSession.__table__)
+    enable()
+    yield enable
+    message_buffer.configure(app, socketio, Message.__table__, enabled=False)
+
+def _session(username):
+    user = register_user(username, f"{username}@example.com", "pass")
+    chatbot = create_chatbot(user.id, "Buffer Bot", "Desc", "public", {"label": "Root", "children": []})
+    return user, create_chat_session(chatbot.id, user.id)
+
+def test_socket_messages_are_broadcast_once_their_batch_is_written(app, buffered):
+    with app.app_context():
+        user, session = _session("bufferuser")
+        client = socketio.test_client(app)
+        client.emit('join', {'session_id': session.id, 'user_id': user.id})
+        client.get_received()
+
+        for i in range(3):
+            client.emit('message', {'session_id': session.id, 'user_id': user.id, 'content': f"m{i}"})
+        assert [e for e in client.get_received() if e['name'] == 'message'] == []
+        assert Message.query.filter_by(chat_session_id=session.id).count() == 0
+        assert message_buffer.stats()['depth'] == 3
+
+        # Readers flush first, and batch order is preserved
+        assert [m.content for m in get_session_messages(session.id)] == ["m0", "m1", "m2"]
+        received = [e['args'] for e in client.get_received() if e['name'] == 'message']
+        assert [(m['seq'], m['content']) for m in received] == [(1, "m0"), (2, "m1"), (3, "m2")]
+        stats = message_buffer.stats()
+        assert stats['depth'] == 0 and stats['flushed'] == 3 and stats['batches'] == 1
+        client.disconnect()
+
+def test_queuing_does_not_commit_per_message(app, buffered):
+    from app.services import queue_message
+
+    with app.app_context():
+        user, session = _session("commituser")
+        other_user, other = _session("commituser2")
+        commits = []
+        listener = lambda conn: commits.append(conn)
+        event.listen(db.engine, 'commit', listener)
+        try:
+            for i in range(10):
+                queue_message(session.id, user.id, f"m{i}")
+            queue_message(other.id, other_user.id, "x")
+            assert commits == []
+
+            # One transaction numbers and inserts the whole batch
+            assert message_buffer.flush_all() == 11
+            assert len(commits) == 1
+        finally:
+            event.remove(db.engine, 'commit', listener)
+
+        db.session.expire_all()
+        assert [m.seq for m in get_session_messages(session.id)] == list(range(1, 11))
+        assert [m.seq for m in get_session_messages(other.id)] == [1]
+        assert db.session.get(ChatSession, session.id).last_seq == 10
+
+def test_failed_batch_is_requeued_in_order(app, buffered):
+    from app.services import queue_message
+
+    with app.app_context():
+        buffered(batch_size=2)
+        user, session = _session("requeueuser")
+        for i in range(3):
+            queue_message(session.id, user.id, f"m{i}")
+
+        with unittest.mock.patch.object(type(db.engine), 'begin', side_effect=OperationalError("insert", {}, Exception("locked"))):
+            with pytest.raises(OperationalError):
+                message_buffer.flush()
+        assert message_buffer.stats()['depth'] == 3
+        assert message_buffer.stats()['failures'] == 1
+
+        assert message_buffer.flush_all() == 3
+        contents = [m.content for m in Message.query.filter_by(chat_session_id=session.id).order_by(Message.id)]
+        assert contents == ["m0", "m1", "m2"]
+
+def test_rejected_row_is_dead_lettered_without_blocking_the_rest(app, buffered):
+    from datetime import datetime, timezone
+
+    with app.app_context():
+        user, session = _session("deadletteruser")
+        def row(content, sender_type='user'):
+            return {'chat_session_id': session.id, 'sender_id': user.id, 'sender_type': sender_type,
+                    'content': content, 'created_at': datetime.now(timezone.utc)}
+        # content is NOT NULL: the database rejects the second row
+        for content in ("m1", None, "m2"):
+            message_buffer.add(row(content))
+
+        assert message_buffer.flush_all() == 2
+        stats = message_buffer.stats()
+        assert stats['depth'] == 0 and stats['dead_lettered'] == 1 and stats['failures'] >= 1
+        assert [r['content'] for r in message_buffer.dead_letters] == [None]
+
+        # Later messages are still written, numbered without gaps
+        message_buffer.add(row("m3"))
+        assert [(m.seq, m.content) for m in get_session_messages(session.id)] == [(1, "m1"), (2, "m2"), (3, "m3")]
+
+def test_readers_do_not_fail_when_the_flush_fails(app, buffered):
+    from app.services import queue_message
+
+    with app.app_context():
+        user, session = _session("readeruser")
+        queue_message(session.id, user.id, "pendiente")
+        with unittest.mock.patch.object(type(db.engine), 'begin', side_effect=OperationalError("insert", {}, Exception("down"))):
+            assert get_session_messages(session.id) == []
+        assert message_buffer.stats()['depth'] == 1
+        assert [m.content for m in get_session_messages(session.id)] == ["pendiente"]
+
+def test_messages_etag_only_changes_once_the_row_is_stored(app, buffered):
+    from app.services import queue_message, save_message, get_session_messages_etag
+
+    with app.app_context():
+        user, session = _session("etaguser")
+        save_message(session.id, user.id, "guardado")
+        stored = get_session_messages_etag(session.id)
+
+        queue_message(session.id, user.id, "pendiente")
+        with unittest.mock.patch.object(type(db.engine), 'begin', side_effect=OperationalError("insert", {}, Exception("down"))):
+            assert get_session_messages_etag(session.id) == stored
+        assert get_session_messages_etag(session.id) != stored
@@ -0,0 +1,46 @@
+from app import socketio
+from app.models import Message
+from app.services import register_user, create_chatbot, create_chat_session, save_message, get_messages_since
+
+def _session(username):
+    user = register_user(username, f"{username}@example.com", "pass")
+    chatbot = create_chatbot(user.id, "Seq Bot", "Desc", "public", {"label": "Root", "children": []})
+    return user, create_chat_session(chatbot.id, user.id)
+
+def _messages(client):
+    # The test client does not wrap 'message' event args in a list
+    return [e['args'] for e in client.get_received() if e['name'] == 'message']
+
+def test_messages_get_per_session_sequence_numbers(app):
+    with app.app_context():
+        user, session = _session("sequser")
+        other_user, other = _session("sequser2")
+        assert [save_message(session.id, user.id, f"m{i}").seq for i in range(3)] == [1, 2, 3]
+        assert save_message(other.id, other_user.id, "x").seq == 1
+
+        missed, complete = get_messages_since(session.id, 1)
+        assert [m.content for m in missed] == ["m1", "m2"] and complete
+        assert get_messages_since(session.id, 0, limit=2)[1] is False
+
+def test_rejoin_replays_only_missed_messages(app):
+    with app.app_context():
+        user, session = _session("replayuser")
+        client = socketio.test_client(app)
+        client.emit('join', {'session_id': session.id, 'user_id': user.id})
+        client.emit('message', {'session_id': session.id, 'user_id': user.id, 'content': "visto"})
+        assert [m['seq'] for m in _messages(client)] == [1]
+        client.disconnect()
+
+        # Sent while the first client was offline
+        for i in range(2):
+            save_message(session.id, user.id, f"perdido {i}")
+
+        client = socketio.test_client(app)
+        client.emit('join', {'session_id': session.id, 'user_id': user.id, 'last_seq': 1})
+        replayed = _messages(client)
+        assert [(m['seq'], m['content']) for m in replayed] == [(2, "perdido 0"), (3, "perdido 1")]
+
+        client.emit('resync', {'session_id': session.id, 'user_id': user.id, 'last_seq': 3})
+        assert _messages(client) == []
+        assert Message.query.filter_by(chat_session_id=session.id).count() == 3
+        client.disconnect()
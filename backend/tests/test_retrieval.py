@@ -0,0 +1,64 @@
+import pytest
+from app.utils.retrieval import BM25Index, ChatbotRetriever, tokenize
+from app.utils.text import html_to_text
+from app.utils.tokens import estimate_tokens
+
+def test_tokenize_strips_accents_and_stopwords():
+    assert tokenize("¿Qué son las Funciones en Python?") == ["son", "funciones", "python"]
+
+def test_html_to_text():
+    html = '<p>Hola <strong>mundo</strong></p><ul><li>Uno</li><li><a href="https://x.io">dos</a></li></ul>'
+    assert html_to_text(html) == "Hola mundo\nUno\nhttps://x.io dos"
+    assert html_to_text("") == ""
+
+def test_bm25_ranks_relevant_documents_first():
+    index = BM25Index([
+        (1, "bucles for while repetir codigo"),
+        (2, "variables almacenan datos"),
+        (3, "funciones bloques reutilizables de codigo"),
+    ])
+    results = index.search("¿Cómo funcionan los bucles?", k=2)
+    assert results[0][0] == 1
+    assert all(score > 0 for _, score in results)
+    assert index.search("astronomia", k=3) == []
+
+def test_chatbot_retriever_paths():
+    tree = {"id": 1, "label": "Python", "content": "", "children": [
+        {"id": 2, "label": "Control de Flujo", "content": "<p>Decide qué código ejecutar</p>", "children": [
+            {"id": 3, "label": "Bucles", "content": "Repite código (for, while).", "children": []}
+        ]},
+        {"id": 4, "label": "Variables", "content": "Las variables almacenan datos.", "children": []}
+    ]}
+    retriever = ChatbotRetriever(tree)
+    assert retriever.search("while", k=2) == [3]
+    assert retriever.path_labels(3) == ["Python", "Control de Flujo", "Bucles"]
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 10) == 10
+
+def test_outline_kb_format_is_compact_and_keeps_hierarchy():
+    from types import SimpleNamespace
+    from app.utils.prompt_builder import compile_prompt
+
+    tree = {"id": 1, "label": "Python", "content": "", "children": [
+        {"id": 2, "label": "Control de Flujo", "content": "<p>Decide qué <strong>código</strong> ejecutar</p>", "children": [
+            {"id": 3, "label": "Bucles", "content": "Repite código (for, while).", "children": []}
+        ]},
+        {"id": 4, "label": "Variables", "content": "Las variables almacenan datos.", "children": []}
+    ]}
+    retriever = ChatbotRetriever(tree)
+    snapshot = SimpleNamespace(title="Python")
+    outline = compile_prompt(snapshot, retriever, 'outline')
+    as_json = compile_prompt(snapshot, retriever, 'json')
+
+    # Ancestors of a selected node appear as bare headings, in tree order
+    assert outline.render_kb([4, 3]) == (
+        "- Python\n"
+        "  - Control de Flujo\n"
+        "    - Bucles: Repite código (for, while).\n"
+        "  - Variables: Las variables almacenan datos."
+    )
+    assert outline.entries[2][0] == "  - Control de Flujo: Decide qué código ejecutar"
+    all_ids = list(retriever.nodes)
+    assert estimate_tokens(outline.render_kb(all_ids)) < estimate_tokens(as_json.render_kb(all_ids)) / 2
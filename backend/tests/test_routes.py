@@ -47,3 +47,196 @@ def test_login_route_invalid(client):
     })
     assert response.status_code == 401
     assert response.json['success'] is False
+
+def test_get_chatbot_route_serves_snapshot(client):
+    client.post('/api/auth/register', json={
+        "username": "treecreator",
+        "email": "tree@example.com",
+        "password": "password123",
+        "role": "creator"
+    })
+    client.post('/api/auth/login', json={"username": "treecreator", "password": "password123"})
+    created = client.post('/api/chatbots', json={
+        "title": "Route Bot",
+        "description": "Desc",
+        "visibility": "public",
+        "tree_json": {"label": "Root", "children": [{"label": "Child", "children": []}]}
+    })
+    chatbot_id = created.json['id']
+
+    response = client.get(f'/api/chatbots/{chatbot_id}')
+    assert response.status_code == 200
+    assert response.json['success'] is True
+    assert response.json['chatbot']['title'] == "Route Bot"
+    assert response.json['tree']['children'][0]['label'] == "Child"
+
+    assert client.get('/api/chatbots/9999').status_code == 404
+    assert 'chatbot_cache' in client.get('/api/metrics').json['metrics']
+    client.post('/api/auth/logout')
+    assert client.get('/api/metrics').status_code == 401
+    client.application.config['METRICS_TOKEN'] = 'secreto'
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer otro'}).status_code == 401
+    assert client.get('/api/metrics', headers={'Authorization': 'Bearer secreto'}).status_code == 200
+
+def test_chatbot_nodes_route_paginates_children(client):
+    client.post('/api/auth/register', json={
+        "username": "lazycreator",
+        "email": "lazy@example.com",
+        "password": "password123",
+        "role": "creator"
+    })
+    client.post('/api/auth/login', json={"username": "lazycreator", "password": "password123"})
+    created = client.post('/api/chatbots', json={
+        "title": "Lazy Bot",
+        "description": "Desc",
+        "visibility": "public",
+        "tree_json": {"label": "Root", "content": "<p>Root</p>", "children": [
+            {"label": f"Child {i}", "content": "<p>x</p>", "children": [
+                {"label": f"Leaf {i}.{j}", "children": []} for j in range(3)
+            ]} for i in range(5)
+        ]}
+    })
+    chatbot_id = created.json['id']
+
+    first = client.get(f'/api/chatbots/{chatbot_id}/nodes?limit=2&depth=2&content=0').json['node']
+    assert first['label'] == "Root"
+    assert 'content' not in first
+    assert first['child_count'] == 5
+    assert [c['label'] for c in first['children']] == ["Child 0", "Child 1"]
+    assert [c['label'] for c in first['children'][0]['children']] == ["Leaf 0.0", "Leaf 0.1"]
+    assert first['children'][0]['child_count'] == 3
+    assert first['children'][0]['next_cursor'] is not None
+
+    second = client.get(f'/api/chatbots/{chatbot_id}/nodes?limit=2&cursor={first["next_cursor"]}').json['node']
+    assert [c['label'] for c in second['children']] == ["Child 2", "Child 3"]
+    assert second['children'][0]['content'] == "<p>x</p>"
+
+    child_id = first['children'][1]['id']
+    expanded = client.get(f'/api/chatbots/{chatbot_id}/nodes/{child_id}').json['node']
+    assert [c['label'] for c in expanded['children']] == ["Leaf 1.0", "Leaf 1.1", "Leaf 1.2"]
+    assert expanded['next_cursor'] is None
+
+    assert client.get(f'/api/chatbots/{chatbot_id}/nodes/99999').status_code == 404
+    assert client.get(f'/api/chatbots/{chatbot_id}/nodes?cursor=bad').status_code == 400
+
+def test_conditional_get_returns_304_until_chatbot_changes(client):
+    client.post('/api/auth/register', json={
+        "username": "etagcreator",
+        "email": "etag@example.com",
+        "password": "password123",
+        "role": "creator"
+    })
+    client.post('/api/auth/login', json={"username": "etagcreator", "password": "password123"})
+    payload = {
+        "title": "ETag Bot",
+        "description": "Desc",
+        "visibility": "public",
+        "tree_json": {"label": "Root", "children": []}
+    }
+    chatbot_id = client.post('/api/chatbots', json=payload).json['id']
+
+    first = client.get(f'/api/chatbots/{chatbot_id}')
+    etag = first.headers['ETag']
+    cached = client.get(f'/api/chatbots/{chatbot_id}', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+
+    listing = client.get('/api/chatbots')
+    list_etag = listing.headers['ETag']
+    assert client.get('/api/chatbots', headers={'If-None-Match': list_etag}).status_code == 304
+
+    client.put(f'/api/chatbots/{chatbot_id}', json={**payload, "title": "ETag Bot v2"})
+    refreshed = client.get(f'/api/chatbots/{chatbot_id}', headers={'If-None-Match': etag})
+    assert refreshed.status_code == 200
+    assert refreshed.json['chatbot']['title'] == "ETag Bot v2"
+    assert client.get('/api/chatbots', headers={'If-None-Match': list_etag}).status_code == 200
+
+def _ask_setup(client, username):
+    client.post('/api/auth/register', json={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": "password123",
+        "role": "creator"
+    })
+    client.post('/api/auth/login', json={"username": username, "password": "password123"})
+    chatbot_id = client.post('/api/chatbots', json={
+        "title": "Queue Bot",
+        "description": "Desc",
+        "visibility": "public",
+        "tree_json": {"label": "Root", "content": "Raíz", "children": []}
+    }).json['id']
+    session_id = client.post('/api/chat-sessions', json={"chatbot_id": chatbot_id}).json['session_id']
+    node_id = client.get(f'/api/chatbots/{chatbot_id}').json['tree']['id']
+    return session_id, node_id
+
+def test_ask_route_queues_job_and_reports_status(client):
+    from unittest.mock import patch
+    from app import socketio
+
+    session_id, node_id = _ask_setup(client, "queuecreator")
+    with patch('app.services.generate_response', return_value="Respuesta en cola"):
+        response = client.post(f'/api/chat-sessions/{session_id}/ask', json={"current_node_id": node_id, "query": "Hola"})
+        assert response.status_code == 202
+        job_id = response.json['job_id']
+
+        for _ in range(100):
+            job = client.get(f'/api/ai-jobs/{job_id}').json['job']
+            if job['status'] in ('done', 'failed'):
+                break
+            socketio.sleep(0.01)
+
+    assert job['status'] == 'done'
+    assert job['response'] == "Respuesta en cola"
+    assert client.get('/api/ai-jobs/unknown').status_code == 404
+    assert client.get('/api/metrics').json['metrics']['ai_jobs']['pending'] == 0
+
+def test_ask_route_rejects_when_queue_is_full(client, ai_jobs):
+    session_id, node_id = _ask_setup(client, "fullcreator")
+    ai_jobs.maxsize = 0
+    response = client.post(f'/api/chat-sessions/{session_id}/ask', json={"current_node_id": node_id, "query": "Hola"})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert ai_jobs.stats()['rejected'] == 1
+
+def test_ask_route_returns_structured_503_when_provider_fails(client, ai_jobs):
+    from unittest.mock import patch
+    from app.utils.ai_client import AIProviderError
+
+    session_id, node_id = _ask_setup(client, "downcreator")
+    ai_jobs.workers = 0 # answer inline
+    with patch('app.services.generate_response', side_effect=AIProviderError('circuit_open', "No disponible", retry_after=30)):
+        response = client.post(f'/api/chat-sessions/{session_id}/ask', json={"current_node_id": node_id, "query": "Hola"})
+    assert response.status_code == 503
+    assert response.json['reason'] == 'circuit_open'
+    assert response.headers['Retry-After'] == '30'
+    assert 'ai_breaker' in client.get('/api/metrics').json['metrics']
+
+def test_session_messages_route_pages_by_cursor(client):
+    from datetime import datetime
+    from app.models import db, Message
+
+    session_id, _ = _ask_setup(client, "historycreator")
+    same_second = datetime(2026, 1, 1, 12, 0, 0)
+    db.session.add_all([
+        Message(chat_session_id=session_id, sender_type='user', content=f"m{i}",
+                created_at=same_second if i < 4 else datetime(2026, 1, 1, 12, 0, i))
+        for i in range(7)
+    ])
+    db.session.commit()
+    url = f'/api/chat-sessions/{session_id}/messages'
+
+    latest = client.get(f'{url}?limit=3').json
+    assert [m['content'] for m in latest['messages']] == ["m4", "m5", "m6"]
+    assert latest['next_cursor'] is None
+
+    older = client.get(f"{url}?limit=3&before={latest['prev_cursor']}").json
+    assert [m['content'] for m in older['messages']] == ["m1", "m2", "m3"]
+    oldest = client.get(f"{url}?limit=3&before={older['prev_cursor']}").json
+    assert [m['content'] for m in oldest['messages']] == ["m0"]
+    assert oldest['prev_cursor'] is None
+
+    newer = client.get(f"{url}?limit=2&after={oldest['next_cursor']}").json
+    assert [m['content'] for m in newer['messages']] == ["m1", "m2"]
+    assert newer['next_cursor'] is not None
+
+    assert client.get(f'{url}?before=bad').status_code == 400
@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from app.utils.socket_queue import SQLQueueManager, create_client_manager
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+PUBLISHER = """
+from app import create_app, socketio
+create_app()
+socketio.emit('message', {'content': 'desde otro worker'}, to='session_7')
+"""
+
+def test_emit_from_another_worker_process_is_relayed(tmp_path):
+    url = f"sqlite:///{tmp_path / 'queue.sqlite3'}"
+    manager = SQLQueueManager(url, poll_interval=0.01)
+    env = {**os.environ, 'SOCKETIO_MESSAGE_QUEUE': f"sql+{url}"}
+    subprocess.run([sys.executable, '-c', PUBLISHER], cwd=BACKEND_DIR, env=env, check=True, timeout=60)
+
+    try:
+        message = json.loads(next(manager._listen()))
+    finally:
+        manager.close()
+    assert message['method'] == 'emit'
+    assert message['event'] == 'message'
+    assert message['room'] == 'session_7'
+    assert message['data'] == {'content': 'desde otro worker'}
+
+CONCURRENT_PUBLISHER = """
+import sys
+from app import create_app, socketio
+create_app()
+for i in range(20):
+    socketio.emit('message', {'content': f'{sys.argv[1]}-{i}'}, to='session_7')
+"""
+
+def test_concurrent_publishers_in_two_processes_are_all_relayed(tmp_path):
+    url = f"sqlite:///{tmp_path / 'queue.sqlite3'}"
+    manager = SQLQueueManager(url)
+    env = {**os.environ, 'SOCKETIO_MESSAGE_QUEUE': f"sql+{url}"}
+    workers = [
+        subprocess.Popen([sys.executable, '-c', CONCURRENT_PUBLISHER, name], cwd=BACKEND_DIR, env=env)
+        for name in ('a', 'b')
+    ]
+    # Poll while both are publishing, then once more after they finish
+    payloads = []
+    deadline = time.time() + 60
+    while any(worker.poll() is None for worker in workers) and time.time() < deadline:
+        payloads += manager._poll()
+        time.sleep(0.01)
+    assert [worker.wait(timeout=5) for worker in workers] == [0, 0]
+    payloads += manager._poll()
+    manager.close()
+
+    contents = [json.loads(payload)['data']['content'] for payload in payloads]
+    assert sorted(contents) == sorted(f"{name}-{i}" for name in ('a', 'b') for i in range(20))
+
+def test_ids_committed_out_of_order_are_not_skipped(tmp_path):
+    manager = SQLQueueManager(f"sqlite:///{tmp_path / 'queue.sqlite3'}")
+    def commit(row_id, channel, content):
+        with manager.engine.begin() as conn:
+            conn.execute(manager.table.insert().values(
+                id=row_id, channel=channel, payload=json.dumps({'content': content}), created_at=0
+            ))
+
+    # id 3 commits before ids 1 and 2 (e.g. two workers publishing at once)
+    commit(3, 'socketio', "tercero")
+    assert [json.loads(p)['content'] for p in manager._poll()] == ["tercero"]
+    commit(1, 'otro-canal', "ajeno")
+    commit(2, 'socketio', "segundo")
+    assert [json.loads(p)['content'] for p in manager._poll()] == ["segundo"]
+    assert manager._gaps == {}
+    assert manager._poll() == []
+    manager.close()
+
+def test_client_manager_selection(tmp_path):
+    assert create_client_manager('') is None
+    manager = create_client_manager('sql', database_url=f"sqlite:///{tmp_path / 'app.sqlite3'}")
+    assert isinstance(manager, SQLQueueManager)
+    manager.close()
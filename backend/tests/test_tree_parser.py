@@ -1,5 +1,5 @@
 import pytest
-from app.utils.tree_parser import validate_tree, nodes_to_json
+from app.utils.tree_parser import validate_tree, nodes_to_json, normalize_tree, TreeValidationError
 from collections import namedtuple
 
 # Mock Node class for testing
@@ -30,3 +30,41 @@ def test_validate_tree_valid():
 def test_validate_tree_invalid():
     tree = {"label": "Root"} # Missing children
     assert validate_tree(tree) is False
+
+def test_normalize_tree_levels():
+    tree = {"label": " Root ", "children": [
+        {"label": "A", "content": None, "children": [{"label": "A1", "children": []}]},
+        {"label": "B", "content": "b", "id": 7, "children": []}
+    ]}
+    levels = normalize_tree(tree)
+    assert [len(level) for level in levels] == [1, 2, 1]
+    assert levels[0][0]["label"] == "Root"
+    assert levels[0][0]["children"] == [0, 1]
+    assert levels[1][0]["content"] == ""
+    assert levels[1][1]["id"] == 7
+    assert levels[1][1]["position"] == 1
+    assert levels[2][0]["parent"] == 0
+
+def test_normalize_tree_error_path():
+    tree = {"label": "Root", "children": [
+        {"label": "A", "children": []},
+        {"label": "B", "children": [{"label": "", "children": []}]}
+    ]}
+    with pytest.raises(TreeValidationError) as exc:
+        normalize_tree(tree)
+    assert exc.value.path == "tree_json.children[1].children[0].label"
+
+def test_normalize_tree_limits():
+    wide = {"label": "Root", "children": [{"label": str(i), "children": []} for i in range(10)]}
+    with pytest.raises(TreeValidationError, match="nodos"):
+        normalize_tree(wide, max_nodes=5)
+    with pytest.raises(TreeValidationError, match="caracteres"):
+        normalize_tree({"label": "x" * 20, "children": []}, max_label_length=10)
+
+def test_normalize_tree_deep_without_recursion():
+    tree = {"label": "Leaf", "children": []}
+    for i in range(5000):
+        tree = {"label": f"Level {i}", "children": [tree]}
+    assert len(normalize_tree(tree, max_depth=10000)) == 5001
+    with pytest.raises(TreeValidationError, match="profundidad"):
+        normalize_tree(tree, max_depth=50)
@@ -40,3 +40,25 @@ export function signup(payload: { nombre_usuario: string; email: string; passwor
 }
 
 
+export interface LazyTreeNode {
+  id: number;
+  label: string;
+  content?: string;
+  summary?: string | null; // plain-text preview, sent instead of content when content=0
+  child_count: number;
+  children?: LazyTreeNode[];
+  next_cursor?: string | null;
+}
+
+export function getChatbotNodes(
+  chatbotId: number | string,
+  options: { nodeId?: number; depth?: number; limit?: number; cursor?: string; content?: boolean } = {}
+) {
+  const params = new URLSearchParams();
+  if (options.depth) params.set('depth', String(options.depth));
+  if (options.limit) params.set('limit', String(options.limit));
+  if (options.cursor) params.set('cursor', options.cursor);
+  if (options.content === false) params.set('content', '0');
+  const nodePath = options.nodeId ? `/nodes/${options.nodeId}` : '/nodes';
+  return request<{ node: LazyTreeNode }>(`/chatbots/${chatbotId}${nodePath}?${params}`, { method: 'GET' });
+}